@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Simulated TI stimulator on a pseudo-terminal (Linux, macOS)
+"""
+Responds to the commands of pyniexp.stimulation.TI like the device, with
+"OK" when a command is done and "ERR <reason>" otherwise. RampWfm is done
+after its ramp duration, other commands after a short processing time.
+Commands are processed in order, so they can be pipelined.
+
+Use config_TI_sim.json (with "Acknowledgement" and "Timeout") and set its
+"Port" to the printed port, or use TISimulator in a script (see
+example_TI.py). The config of the real device (config_TI.json) does not
+assume responses.
+
+usage: python TI_simulator.py [--latency s]
+"""
+
+import os, tty, argparse
+from threading import Thread
+from time import sleep
+
+class TISimulator:
+
+    def __init__(self,latency=0.005):
+        self.latency = latency # s, processing time of a command
+        self.log = [] # commands received
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    def start(self):
+        Thread(target=self._run,daemon=True).start()
+        return self.port
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+    def respond(self,cmd):
+        words = cmd.split()
+        if not(len(words)): return 'ERR empty command'
+        if words[0] == 'DDS' and len(words) == 3: sleep(self.latency)
+        elif words[0] == 'ChConfig' and len(words) == 9: sleep(self.latency)
+        elif words[0] == 'RampWfm' and len(words) == 7: sleep(self.latency + float(words[-1])/1000)
+        else: return 'ERR unknown command: ' + cmd
+        return 'OK'
+
+    def _run(self):
+        cmd = b''
+        while True:
+            try: data = os.read(self._master,1024)
+            except OSError: break
+            for c in data:
+                if c == ord('\r'):
+                    self.log.append(cmd.decode())
+                    os.write(self._master,(self.respond(cmd.decode())+'\r\n').encode())
+                    cmd = b''
+                else: cmd += bytes([c])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated TI stimulator')
+    parser.add_argument('--latency', type=float, default=0.005, help='processing time of a command [s]')
+    args = parser.parse_args()
+
+    sim = TISimulator(latency=args.latency)
+    print('TI simulator on {}'.format(sim.start()))
+    try:
+        while True: sleep(1)
+    except KeyboardInterrupt: sim.close()
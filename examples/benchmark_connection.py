@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Loopback benchmark for pyniexp.connection
+"""
+Measures throughput (messages/s, MB/s) and one-way and round-trip latency
+(p50/p99) of Udp, Tcp and Shm for scalar, string and array payloads in each
+receive mode. Sender, receiver and echo run as threads of this process on
+127.0.0.1, so the clocks are shared and one-way latency needs no time stamp.
+
+Results are written as one JSON object per scenario (JSON Lines).
+
+usage: python benchmark_connection.py [--messages N] [--latency-messages N]
+        [--interval s] [--array-size N] [--port P] [--output FILE]
+"""
+
+import argparse, json, sys
+from threading import Thread
+from time import perf_counter, sleep
+import numpy as np
+
+from pyniexp.connection import Udp, Tcp, Shm, _array_header
+
+STR_FORMAT = 'NF{:06d}' # 8 characters, carrying the message index
+STR_LENGTH = len(STR_FORMAT.format(0))
+UDP_CONTROL_SIGNAL = '#END' # multi-byte, so that no index sent as int collides with it
+
+# class -> payload -> receive modes
+SCENARIOS = {
+    Udp: {'scalar': ['float', 'int'], 'string': ['str'], 'array': ['array']},
+    Tcp: {'scalar': ['float', 'int'], 'string': ['str', 'bytes'], 'array': ['array']},
+    Shm: {'scalar': ['float', 'int'], 'string': ['str'], 'array': ['array']}
+}
+
+def connect_pair(cls,port):
+    if cls is Shm: kwargs = {'name': 'pyniexp_benchmark_{:d}'.format(port)}
+    else: kwargs = {'IP': '127.0.0.1'}
+    if cls is Udp: kwargs['control_signal'] = UDP_CONTROL_SIGNAL
+    receiver = cls(port=port,**kwargs)
+    sender = cls(port=port,**kwargs)
+    for c in [receiver, sender]: c.quiet = True; c.timeout = 1
+
+    if cls is Udp:
+        th = Thread(target=receiver.connect_for_receiving); th.start()
+        while receiver._socket.getsockname()[1] != port: sleep(0.001) # wait for bind
+        sender.connect_for_sending()
+    elif cls is Shm:
+        th = Thread(target=receiver.connect_for_receiving); th.start()
+        sender.connect_for_sending() # waits for the shared memory
+    else:
+        th = Thread(target=receiver.open_as_server); th.start()
+        while not(sender.is_open):
+            try: sender.open_as_client()
+            except ConnectionRefusedError: sleep(0.01)
+    th.join()
+    return sender, receiver
+
+def send(conn,mode,i,arr):
+    if mode == 'float': conn.send_data(float(i))
+    elif mode == 'int': conn.send_data(int(i))
+    elif mode in ['str', 'bytes']: conn.send_data(STR_FORMAT.format(i))
+    elif mode == 'array': arr[0] = i; conn.send_array(arr)
+
+def receive(conn,mode,arr):
+    if mode == 'array':
+        d = conn.receive_array(arr)
+        if d is None: return
+        return int(d[0])
+
+    if mode in ['str', 'bytes'] and type(conn) == Tcp: d = conn.receive_data(n=STR_LENGTH,dtype=None if mode == 'bytes' else 'str')
+    else: d = conn.receive_data(n=1,dtype=mode)
+    if not(len(d)): return
+
+    if mode == 'bytes': return int(b''.join(d)[2:])
+    elif mode == 'str' and type(conn) == Tcp: return int(d[2:])
+    elif mode == 'str': return int(d[0][2:])
+    else: return int(d[0])
+
+def message_size(cls,mode,arr):
+    if mode in ['float', 'int']: return 8 if cls is Shm else 4 # Shm stores int64 and float64
+    elif mode in ['str', 'bytes']: return STR_LENGTH
+    else: return arr.nbytes + _array_header.size
+
+def percentiles(t):
+    if not(len(t)): return None, None
+    return tuple(float(v) for v in np.percentile(np.array(t)*1000,[50, 99]))
+
+def run_scenario(cls,payload,mode,port,args):
+    arr_send = np.zeros(args.array_size)
+    arr_receive = np.zeros(args.array_size)
+    result = {'class': cls.__name__, 'payload': payload, 'receive_mode': mode, 'message_bytes': message_size(cls,mode,arr_send)}
+
+    # Throughput: send as fast as possible
+    sender, receiver = connect_pair(cls,port)
+    received = []
+    def receive_all():
+        while len(received) < args.messages:
+            i = receive(receiver,mode,arr_receive)
+            if i is None: break
+            received.append(i)
+    th = Thread(target=receive_all); th.start()
+    t0 = perf_counter()
+    for i in range(args.messages): send(sender,mode,i,arr_send)
+    th.join()
+    t = perf_counter() - t0 - (receiver.timeout if len(received) < args.messages else 0)
+    result.update({
+        'messages_sent': args.messages, 'messages_received': len(received),
+        'msg_per_s': len(received)/t, 'MB_per_s': len(received)*result['message_bytes']/t/1e6})
+    sender.close(); receiver.close()
+
+    # One-way latency: paced sending, shared clock
+    sender, receiver = connect_pair(cls,port+1)
+    t_send = {}; t_receive = {}
+    def receive_timed():
+        while len(t_receive) < args.latency_messages:
+            i = receive(receiver,mode,arr_receive)
+            if i is None: break
+            t_receive[i] = perf_counter()
+    th = Thread(target=receive_timed); th.start()
+    for i in range(args.latency_messages):
+        t_send[i] = perf_counter(); send(sender,mode,i,arr_send)
+        sleep(args.interval)
+    th.join()
+    result['one_way_p50_ms'], result['one_way_p99_ms'] = percentiles([t_receive[i]-t_send[i] for i in t_receive])
+    sender.close(); receiver.close()
+
+    # Round-trip latency: echo over a second connection
+    sender, receiver = connect_pair(cls,port+2)
+    echo_sender, echo_receiver = connect_pair(cls,port+3)
+    arr_echo = np.zeros(args.array_size)
+    def echo():
+        for n in range(args.latency_messages):
+            i = receive(receiver,mode,arr_echo)
+            if i is None: break
+            send(echo_sender,mode,i,arr_echo)
+    th = Thread(target=echo); th.start()
+    rtt = []
+    for i in range(args.latency_messages):
+        t0 = perf_counter(); send(sender,mode,i,arr_send)
+        if receive(echo_receiver,mode,arr_receive) == i: rtt.append(perf_counter()-t0)
+        sleep(args.interval)
+    th.join()
+    result['round_trip_p50_ms'], result['round_trip_p99_ms'] = percentiles(rtt)
+    for c in [sender, receiver, echo_sender, echo_receiver]: c.close()
+
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loopback benchmark for pyniexp.connection')
+    parser.add_argument('--messages', type=int, default=10000, help='number of messages for the throughput test')
+    parser.add_argument('--latency-messages', type=int, default=1000, help='number of messages for the latency tests')
+    parser.add_argument('--interval', type=float, default=0.001, help='interval between messages for the latency tests [s]')
+    parser.add_argument('--array-size', type=int, default=1000, help='number of float64 elements in the array payload')
+    parser.add_argument('--port', type=int, default=5100, help='first port (each scenario uses 4 consecutive ports)')
+    parser.add_argument('--output', default=None, help='JSON Lines output file (default: stdout)')
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output is None else open(args.output,'w')
+    port = args.port
+    for cls, payloads in SCENARIOS.items():
+        for payload, modes in payloads.items():
+            for mode in modes:
+                out.write(json.dumps(run_scenario(cls,payload,mode,port,args)) + '\n'); out.flush()
+                port += 4
+    if not(args.output is None): out.close()
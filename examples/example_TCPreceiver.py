@@ -28,7 +28,7 @@ while receiver.is_open:
     data_cond = receiver.receive_data(n=3,dtype='str')
     data_fb = receiver.receive_data(n=1,dtype='int')
     if len(data_cond) > 1:
-        receiver.log('volume #{:3d}, condition: {}, feedback: {} - {}'.format(n,data_cond[1],data_fb[0],data_fb[1]))
+        receiver.log('volume #{:3d}, condition: {}, feedback: {} - {} (latency: {:.3f}ms)'.format(n,data_cond[1],data_fb[0],data_fb[1],receiver.latency*1000))
     elif receiver.is_open: receiver.log('volume #{:3d} no data!'.format(n))
 
 receiver.close()
\ No newline at end of file
@@ -21,6 +21,7 @@ sender.open_as_client()
 sender.sending_time_stamp = True
 
 sender.info()
+sender.synchronise_clock() # answered by the receiver while receiving
 
 for data in ['Bas',34,'Reg',78]:
     sender.send_data(data)
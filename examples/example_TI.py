@@ -1,11 +1,19 @@
 from pyniexp.stimulation import TI
+from time import sleep
 
 stim = TI()
+# With the simulated device (Linux, macOS):
+# from TI_simulator import TISimulator
+# stim = TI('config_TI_sim.json'); stim.port = TISimulator().start()
 stim.connect()
 
 stim.load()
 
 stim.start()
+for tr in range(10): # closed loop: non-blocking amplitude updates
+    stim.setAmplitude([2+tr/10, 2+tr/10])
+    sleep(2)
 stim.stop()
+print([c['Command'] for c in stim.commandLog])
 
-stim = None
\ No newline at end of file
+stim = None
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# testing UDP multicast
+
+from pyniexp.connection import Udp
+from time import sleep
+
+UDP_GROUP = "239.0.0.1"
+UDP_PORT = 1234
+UDP_CONTROL_CHAR = '#'
+
+publisher = Udp(IP=UDP_GROUP,port=UDP_PORT,control_signal=UDP_CONTROL_CHAR)
+publisher.multicast_interface = '127.0.0.1' # local host only; use '0.0.0.0' (default) for the local network
+
+publisher.connect_for_publishing()
+publisher.sending_time_stamp = True
+
+publisher.info()
+
+for data in ['Bas',34.0,'NF',78.0]:
+    publisher.send_data(data)
+    sleep(1)
+
+publisher.close()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# testing UDP multicast (run several instances with example_UDPpublisher.py)
+
+from pyniexp.connection import Udp
+
+UDP_GROUP = "239.0.0.1"
+UDP_PORT = 1234
+UDP_CONTROL_CHAR = '#'
+
+subscriber = Udp(IP=UDP_GROUP,port=UDP_PORT,control_signal=UDP_CONTROL_CHAR)
+subscriber.multicast_interface = '127.0.0.1' # local host only; use '0.0.0.0' (default) for the local network
+
+subscriber.connect_for_subscribing()
+subscriber.sending_time_stamp = True
+
+subscriber.info()
+
+n = 0
+cond = 'test'
+while subscriber.is_open:
+    data = subscriber.receive_data(n=1,dtype='float')
+    if len(data) > 1:
+        if type(data[1]) == str:
+            cond = data[1]
+            continue
+
+        n += 1
+        subscriber.log('volume #{:3d}, condition: {}, feedback: {} - {}'.format(n,cond,data[0],data[1]))
+    elif subscriber.is_open: subscriber.log('volume #{:3d} no data!'.format(n))
+
+subscriber.close()
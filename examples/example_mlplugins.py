@@ -15,14 +15,14 @@ if __name__ == '__main__':
     mlp.connect(start=True, name_prefix='test')
     mlp.engine.assignin('base','sig',0,nargout=0)
 
-    t = myImageProcess(imgDim)
+    t = myImageProcess(imgDim) # or myImageProcess(imgDim, n_workers=4, slabs=3) for parallel processing (results ordered in reduce())
 
     it = 0
     while it < 5:
         cit = mlp.engine.evalin('base','sig')
         if cit > it:
             it = cit
-            t.load_image(mlp.engine.workspace['img']._data.tolist())
+            t.load_data(mlp.engine.workspace['img'])
             sleep(2)
 
     t = None
@@ -17,8 +17,70 @@ for f in freqs:
     print(f)
     wave1.frequency = f
     wave2.frequency = f
-    stim.loadWaveform([wave1, wave2])
+    stim.loadWaveform([wave1, wave2]) # or stim.streamWaveform([wave1, wave2]) for long waves (constant memory)
     stim.stimulate()
-    sleep(15)
+    stim.waitUntilDone() # no polling
+    sleep(5)
 
-stim = None
\ No newline at end of file
+# Same conditions from a bank: waves are generated and the task is configured only once
+stim.prepareBank({f: [Waveform(amplitude = 1, frequency = f, phase=p, duration = 10.0, rampUp = 3, rampDown = 3, samplingRate = 1000) 
+    for p in [0, phase]] for f in freqs})
+for f in freqs:
+    stim.switchTo(f, waitUntilFinished=True)
+    stim.stimulate()
+stim.sequence(freqs, waitUntilFinished=True) # back-to-back
+stim.stimulate()
+sleep(len(freqs)*10)
+print('Switching latency: {}'.format(stim.switchLatency))
+
+stim = None
+# Composed waveforms: amplitude-modulated tone and a temporal interference pair with per-channel settings
+from pyniexp.stimulation import Tone
+envelope = [(0,0), (3,1), (7,1), (10,0)]
+am = ((1 + 0.5*Tone(amplitude=2, frequency=5)) * Tone(amplitude=1, frequency=100)).envelope(envelope)
+ti = Tone(amplitude=[1, 1], frequency=[2000, 2010], phase=[0, phase]).envelope(envelope)
+am.samplingRate = ti.samplingRate = 20000
+
+stim = Stimulator(configFile=r'D:\Projects\pyniexp\examples\config_stimulation_sim.json')
+stim.loadWaveform(ti) # one wave with two channels
+stim.stimulate()
+sleep(15)
+stim.loadWaveform([am, am]) # one wave per channel
+stim.stimulate()
+sleep(15)
+
+stim = None
+
+# Hardware-locked onset: output starts on the scanner pulse (PFI terminal in the config) instead of on stimulate()
+stim = Stimulator(configFile=r'D:\Projects\pyniexp\examples\config_stimulation_sim.json')
+stim.armTrigger(retriggerable=True, everyN=4) # replay on every 4th pulse
+stim.loadWaveform([wave1, wave2])
+stim.stimulate() # arms
+sleep(30)
+print('Last onset (device time): {}'.format(stim.triggerTime))
+
+stim = None
+
+# Closed loop: LiveTone parameters are updated while streaming, without gap and phase-continuous
+from pyniexp.stimulation import LiveTone
+live = LiveTone(amplitude=[1, 1], frequency=[2000, 2010], duration=60, samplingRate=20000, transition=0.1)
+stim = Stimulator(configFile=r'D:\Projects\pyniexp\examples\config_stimulation_sim.json')
+stim.streamWaveform([live], leadTime=0.1, chunkDuration=0.02)
+stim.stimulate()
+for tr in range(20):
+    sleep(2)
+    stim.update(amplitude=[1+tr/20, 1+tr/20]) # e.g. from the neurofeedback signal
+print('Update latency: {}'.format(stim.updateLatency))
+
+stim = None
+
+# Out-of-process: the device is owned by a service (python -m pyniexp.stimulatorservice config_stimulation.json 5200), 
+# and any number of scripts (or StimulatorApp(service=('127.0.0.1', 5200))) control it without blocking
+from pyniexp.stimulatorservice import StimulatorClient
+stim = StimulatorClient(port=5200)
+stim.onDone = lambda: print('Done')
+stim.loadWaveform([wave1, wave2]) # sent as one binary array
+stim.stimulate() # returns immediately
+print(stim.status)
+stim.waitUntilDone()
+stim.close()
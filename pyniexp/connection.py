@@ -1,11 +1,41 @@
-import socket, sys, struct
+import socket, sys, struct, ipaddress, atexit
+import numpy as np
+from collections import deque
 from datetime import datetime
 from select import select
-from pyniexp.utils import clock
+from time import time, perf_counter, sleep
+from multiprocessing import shared_memory, resource_tracker
+from threading import Thread, Condition
+from pyniexp.utils import clock, Histogram
+from pyniexp.log import logger
 
 if sys.byteorder == 'little': byteorder = '<'
 elif sys.byteorder == 'big': byteorder = '>'
 
+# Array header: magic, dtype (e.g. '<f8'), ndim, time stamp, sequence number, shape (up to 8 dimensions)
+ARRAY_MAGIC = b'NA'
+ARRAY_MAX_NDIM = 8
+_array_header = struct.Struct('<2s4sBdI{:d}I'.format(ARRAY_MAX_NDIM))
+
+# UDP array chunk header (each datagram of an array, after the array header in the first): magic, array id, byte offset
+CHUNK_MAGIC = b'NC'
+_chunk_header = struct.Struct('<2sIQ')
+
+# Time stamps: 64-bit seconds since the epoch (as time()) advancing with the monotonic high-resolution clock, so that
+# time stamps of a remote host are meaningful even without synchronise_clock (up to the difference of the system clocks)
+_time_origin = (time(), perf_counter())
+def time_stamp():
+    return _time_origin[0] + perf_counter() - _time_origin[1]
+
+# Clock synchronisation messages: magic, three time stamps
+CLOCK_PING = b'\x00NTQ'
+CLOCK_PONG = b'\x00NTA'
+CLOCK_RESULT = b'\x00NTR'
+_clock_message = struct.Struct('<4sddd')
+
+# Linux delivers every joined group to every socket bound to the port unless this is switched off
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49) if sys.platform.startswith('linux') else None
+
 
 class __Connect(clock):
 
@@ -48,7 +78,7 @@ class __Connect(clock):
             val = val[0]
         
         if type(val) == str: 
-            self._control_signal['n_bytes'] = n*1
+            self._control_signal['n_bytes'] = n*len(val.encode(self.encoding))
             self._control_signal['decode'] = lambda d: [d.decode(self.encoding)]
         elif type(val) == int: 
             self._control_signal['n_bytes'] = n*struct.calcsize('i')
@@ -96,12 +126,30 @@ class __Connect(clock):
                 'n_bytes': struct.calcsize('f'),
                 'encode': lambda d: struct.pack('<f',d),
                 'decode': lambda d: struct.unpack('<f',d)[0]
+            },
+            'double': {
+                'format':'d',
+                'n_bytes': struct.calcsize('d'),
+                'encode': lambda d: struct.pack('<d',d),
+                'decode': lambda d: struct.unpack('<d',d)[0]
             }
         }
 
         self.sending_time_stamp = False
+        self.sending_sequence_number = False # detects lost, duplicated and reordered (UDP) messages
         self.wait_for_controlsignal = False
         self.quiet = False
+        self.quiet_failures = False # errors and warnings are logged as debug (e.g. while retrying)
+
+        self.clock_offset = 0 # remote - local time stamp [s] (see synchronise_clock)
+        self.clock_delay = None # round-trip delay of the exchange used for clock_offset [s]
+        self.latency = None # one-way transport latency of the last time-stamped message [s]
+
+        # Metrics
+        self._sequence = 0
+        self._expected_sequence = None
+        self._recent_sequences = deque(maxlen=1024)
+        self.reset_stats()
 
         self._socket = None
         self._status = 0 # 0 - closed; -1 - open for receiving; 1 - open for sending
@@ -120,10 +168,21 @@ class __Connect(clock):
         print("\tEncoding:\t\t", self.encoding)
         print("\tControl signal:\t", self.control_signal)
     
+    def stats(self):
+        s = dict(self._stats)
+        s['latency'] = self._latency.summary()
+        return s
+
+    def reset_stats(self):
+        self._stats = dict.fromkeys(['messages_sent', 'messages_received', 'bytes_sent', 'bytes_received', 
+            'errors', 'timeouts', 'lost', 'duplicated', 'reordered'], 0)
+        self._latency = Histogram()
+
     def close(self,send_control_signal=True):
         if self.is_open:
             if len(self.control_signal) and send_control_signal: 
                 self.sending_time_stamp = False
+                self.sending_sequence_number = False
                 self.send_data(self.control_signal)
             
             if self.wait_for_controlsignal: pass
@@ -135,6 +194,56 @@ class __Connect(clock):
     def ready_to_receive(self):
         return len(select([self._socket],[],[],0.001)[0]) > 0
 
+    def _wait_to_receive(self):
+        if len(select([self._socket],[],[],self.timeout)[0]): return True
+        self._stats['timeouts'] += 1
+        return False
+
+    def _is_control_signal(self):
+        if not(self._control_signal['n_bytes']): return False
+        try:
+            return self._control_signal['decode'](self._peek_control_signal()) == self.control_signal
+        except: 
+            return False
+
+    def _peek_control_signal(self):
+        return self._peek(self._control_signal['n_bytes'])
+
+    def _next_sequence(self):
+        seq = self._sequence
+        self._sequence = (self._sequence + 1) % 2**32
+        return seq
+
+    def _track_sequence(self,seq):
+        exp = self._expected_sequence
+        if exp is None or seq == exp:
+            self._expected_sequence = (seq + 1) % 2**32
+        elif (seq - exp) % 2**32 < 2**31: # ahead: messages in between are missing
+            self._stats['lost'] += (seq - exp) % 2**32
+            self._expected_sequence = (seq + 1) % 2**32
+        elif seq in self._recent_sequences:
+            self._stats['duplicated'] += 1
+            return
+        else: # late: it has been counted as lost
+            self._stats['reordered'] += 1
+            self._stats['lost'] -= 1
+        self._recent_sequences.append(seq)
+
+    def _sendmsg(self,buffers):
+        if hasattr(self._socket,'sendmsg'): return self._socket.sendmsg(buffers)
+        else: return self._socket.send(b''.join(buffers)) # no scatter-gather (e.g. Windows)
+
+    def _recvmsg_into(self,buffers):
+        if hasattr(self._socket,'recvmsg_into'): return self._socket.recvmsg_into(buffers)[0]
+        
+        d = self._socket.recv(sum([len(b) for b in buffers])) # no scatter-gather (e.g. Windows)
+        n = 0
+        for b in buffers:
+            k = max(0,min(len(b),len(d)-n)) # the datagram may be shorter
+            b[:k] = d[n:n+k]
+            n += k
+        return len(d)
+
     def send_data(self,dat):
         if not(self.status_for_sending):
             self.log('ERROR - Connection with {:s} is not ready for sending!'.format(self.remote_address))
@@ -143,13 +252,126 @@ class __Connect(clock):
         if type(dat) != list: dat = [dat]
         
         t = datetime.now()
-        if self.sending_time_stamp: dat.insert(0,t.timestamp())
+        n_bytes = 0
+        if self.sending_sequence_number: n_bytes += self._socket.send(self._formats['uint']['encode'](self._next_sequence()))
+        if self.sending_time_stamp: n_bytes += self._socket.send(self._formats['double']['encode'](time_stamp()))
         
         for d in dat:
-            if type(d) == str: self._socket.send(bytes(d,self.encoding))
-            else: self._socket.send(self._formats[type(d).__name__]['encode'](d))
-            
-        return t, len(dat)-self.sending_time_stamp
+            if type(d) == str: n_bytes += self._socket.send(bytes(d,self.encoding))
+            else: n_bytes += self._socket.send(self._formats[type(d).__name__]['encode'](d))
+
+        self._stats['messages_sent'] += 1
+        self._stats['bytes_sent'] += n_bytes
+        return t, len(dat)
+
+    def send_array(self,arr):
+        if not(self.status_for_sending):
+            self.log('ERROR - Connection with {:s} is not ready for sending!'.format(self.remote_address))
+            return
+
+        arr = np.asarray(arr,order='C') # no copy if already C-contiguous
+        if arr.ndim > ARRAY_MAX_NDIM or arr.dtype.kind in 'OVMm' or len(arr.dtype.str) > 4: # no buffer or no round trip via dtype.str
+            self.log('ERROR - Array of {:d} dimension(s) and type {} cannot be sent!'.format(arr.ndim,arr.dtype))
+            return
+
+        t = datetime.now()
+        header = _array_header.pack(ARRAY_MAGIC, arr.dtype.str.encode(), arr.ndim, 
+            time_stamp() if self.sending_time_stamp else 0, self._next_sequence() if self.sending_sequence_number else 0,
+            *(arr.shape + (0,)*(ARRAY_MAX_NDIM-arr.ndim)))
+        if self._send_array_buffers(header,memoryview(arr.reshape(-1)).cast('B')) is False: return
+
+        self._stats['messages_sent'] += 1
+        self._stats['bytes_sent'] += len(header) + arr.nbytes
+
+        return t, arr.size
+
+    def receive_array(self,out=None):
+        if not(self.status_for_receiving):
+            self.log('ERROR - Connection with {:s} is not ready for receiving!'.format(self.remote_address))
+            return
+
+        if not(self._wait_to_receive()): return
+        while self._handle_clock_message():
+            if not(self._wait_to_receive()): return
+
+        # check for closing signal
+        if self._is_control_signal():
+            self.close(self.wait_for_controlsignal)
+            return
+
+        header = self._peek_array_header()
+        if header is None: return
+        magic, dt, ndim, ts, seq, *shape = _array_header.unpack(header)
+        if magic != ARRAY_MAGIC:
+            self.log('ERROR - No array header received from {:s}!'.format(self.remote_address))
+            self._discard_message()
+            return
+
+        dt = np.dtype(dt.rstrip(b'\0').decode())
+        shape = tuple(shape[:ndim])
+        if out is None or out.dtype != dt or out.shape != shape or not(out.flags.c_contiguous):
+            out = np.empty(shape,dtype=dt)
+
+        if not(self._receive_array_buffers(memoryview(out.reshape(-1)).cast('B'))): return
+
+        self._stats['messages_received'] += 1
+        self._stats['bytes_received'] += len(header) + out.nbytes
+        if self.sending_sequence_number: self._track_sequence(seq)
+        if self.sending_time_stamp: return [self._decode_time_stamp(ts), out]
+        else: return out
+
+    def synchronise_clock(self,n=8):
+        # NTP-style exchange; the other end answers while it is receiving (receive_data/receive_array)
+        if not(self.is_open):
+            self.log('ERROR - Connection with {:s} is not open!'.format(self.remote_address))
+            return
+
+        samples = []
+        for i in range(n):
+            self._send_message(_clock_message.pack(CLOCK_PING, time_stamp(), 0, 0))
+            if not(self._wait_to_receive()):
+                self.log('WARNING - No clock response from {:s}'.format(self.remote_address))
+                break
+            d = self._recv_message(_clock_message.size)
+            t3 = time_stamp()
+            if d is None:
+                self.log('WARNING - No clock response from {:s}'.format(self.remote_address))
+                break
+            magic, t0, t1, t2 = _clock_message.unpack(d)
+            if magic != CLOCK_PONG:
+                self.log('ERROR - Unexpected response to clock synchronisation from {:s}'.format(self.remote_address))
+                break
+            samples.append((((t1-t0) + (t2-t3))/2, (t3-t0) - (t2-t1))) # offset, delay
+        if not(len(samples)): return
+
+        # the exchange with the shortest round trip is the least affected by queueing
+        self.clock_offset, self.clock_delay = min(samples, key=lambda s: s[1])
+        self._send_message(_clock_message.pack(CLOCK_RESULT, -self.clock_offset, self.clock_delay, 0))
+        self.log('Clock offset to {:s}: {:.6f}s (delay: {:.6f}s)'.format(self.remote_address,self.clock_offset,self.clock_delay))
+        return self.clock_offset, self.clock_delay
+
+    def _handle_clock_message(self):
+        if not(self._peek(len(CLOCK_PING)) in [CLOCK_PING, CLOCK_RESULT]): return False
+
+        t1 = time_stamp()
+        d = self._recv_message(_clock_message.size)
+        if d is None: return False # closed
+        magic, t0, v1, v2 = _clock_message.unpack(d)
+        if magic == CLOCK_PING:
+            self._send_message(_clock_message.pack(CLOCK_PONG, t0, t1, time_stamp()))
+        else: # CLOCK_RESULT
+            self.clock_offset, self.clock_delay = t0, v1
+            self.log('Clock offset to {:s}: {:.6f}s (delay: {:.6f}s)'.format(self.remote_address,self.clock_offset,self.clock_delay))
+        return True
+
+    def _decode_time_stamp(self,ts):
+        ts -= self.clock_offset # remote -> local
+        self.latency = time_stamp() - ts
+        self._latency.add(self.latency)
+        return datetime.fromtimestamp(ts)
+
+    def _discard_message(self):
+        pass
 
     def flush(self):
         try:
@@ -158,8 +380,11 @@ class __Connect(clock):
             pass
 
     def log(self,msg):
-        if ~self.quiet | any([msg.find(s) != -1 for s in ['ERROR','WARNING','USER']]):
-            print('[{:.3f}s] {:s}'.format(self.clock, msg))
+        if msg.find('ERROR') != -1: self._stats['errors'] += 1
+        if self.quiet_failures and (msg.find('ERROR') != -1 or msg.find('WARNING') != -1): logger.debug('[{:.3f}s] {:s}', self.clock, msg)
+        elif msg.find('ERROR') != -1: logger.error('[{:.3f}s] {:s}', self.clock, msg)
+        elif msg.find('WARNING') != -1: logger.warning('[{:.3f}s] {:s}', self.clock, msg)
+        elif not(self.quiet) or msg.find('USER') != -1: logger.info('[{:.3f}s] {:s}', self.clock, msg)
 
 
 class Udp(__Connect):
@@ -184,18 +409,40 @@ class Udp(__Connect):
     def __init__(self,IP='127.0.0.1',port=1234,encoding='UTF-8',control_signal='#',timeout=20):
         super().__init__(IP,port,encoding,control_signal,timeout)
 
+        self.max_datagram_size = 65507 # arrays larger than this are sent in chunks
+        self.receive_buffer_size = 4*1024*1024 # room for chunked arrays (capped by the OS, e.g. net.core.rmem_max)
+
+        # Multicast (IP in 224.0.0.0/4)
+        self.multicast_interface = '0.0.0.0' # '127.0.0.1' to stay on the local host
+        self.multicast_ttl = 1 # 1 - local network only
+        self.multicast_loopback = True # deliver to subscribers on the sending host
+
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._groups = []
+        self._peer_address = None
+        self._array_id = 0
+
+    @property
+    def is_multicast(self):
+        try: return ipaddress.ip_address(socket.gethostbyname(self.IP)).is_multicast # hostnames are resolved
+        except (ValueError, OSError): return False
+
+    @property
+    def groups(self):
+        return [g[0] for g in self._groups]
 
     def connect_for_receiving(self):
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
         self._socket.bind((self.IP, self.port))
 
         if len(self.control_signal):
-            data = [0]
-            while chr(data[0]) != self.control_signal[0]:
+            data = b''
+            while data.decode(self.encoding,'replace') != self.control_signal[0]:
                 while not(self.ready_to_receive()): pass
-                data, addr= self._socket.recvfrom(16)
+                data, addr= self._socket.recvfrom(max(16,self._control_signal['n_bytes']))
                 self._is_IP_confirmed = addr[0] == self.IP
         self.IP = addr[0]
+        self._peer_address = addr
         self._status = -1
         self.log('Connection with {:s} is {:s}'.format(self.remote_address,self.status))
     
@@ -205,7 +452,7 @@ class Udp(__Connect):
             self._status = 1
             self._is_IP_confirmed = True
         else:
-            self.log('Establishing connection for sending with {:s} failed with error: {:s}'.format(self.remote_address,err))
+            self.log('ERROR - Establishing connection for sending with {:s} failed with error: {:d}'.format(self.remote_address,err))
             return
 
         if len(self.control_signal): 
@@ -213,6 +460,68 @@ class Udp(__Connect):
             self.send_data(self.control_signal)
         self.log('Connection with {:s} is {:s}'.format(self.remote_address,self.status))
 
+    def connect_for_publishing(self):
+        if not(self.is_multicast):
+            self.log('ERROR - {:s} is not a multicast group!'.format(self.IP))
+            return
+
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(self.multicast_loopback))
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.multicast_interface))
+        err = self._socket.connect_ex(((self.IP, self.port)))
+        if err:
+            self.log('ERROR - Publishing to group {:s} failed with error: {:d}'.format(self.IP,err))
+            return
+
+        # no handshake: subscribers may join (and leave) at any time
+        self._status = 1
+        self._is_IP_confirmed = True
+        self.log('Connection with group {:s} is {:s}'.format(self.remote_address,self.status))
+
+    def connect_for_subscribing(self):
+        if not(self.is_multicast):
+            self.log('ERROR - {:s} is not a multicast group!'.format(self.IP))
+            return
+
+        # allow several subscribers on the same host
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'): self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if not(IP_MULTICAST_ALL is None): self._socket.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+        try:
+            self._socket.bind((self.IP, self.port)) # receive only this group
+        except OSError: # e.g. Windows
+            self._socket.bind(('', self.port))
+        self.join_group(self.IP)
+
+        self._status = -1
+        self._is_IP_confirmed = True
+        self.log('Connection with group {:s} is {:s}'.format(self.remote_address,self.status))
+
+    def join_group(self,group=None,interface=None):
+        if group is None: group = self.IP
+        if interface is None: interface = self.multicast_interface
+        if (group, interface) in self._groups: return
+
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack('4s4s',socket.inet_aton(group),socket.inet_aton(interface)))
+        self._groups.append((group, interface))
+        self.log('Joined group {:s} on {:s}'.format(group,interface))
+
+    def leave_group(self,group=None,interface=None):
+        if group is None: group = self.IP
+        if interface is None: interface = self.multicast_interface
+        if not((group, interface) in self._groups):
+            self.log('WARNING - Group {:s} on {:s} has not been joined'.format(group,interface))
+            return
+
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, struct.pack('4s4s',socket.inet_aton(group),socket.inet_aton(interface)))
+        self._groups.remove((group, interface))
+        self.log('Left group {:s} on {:s}'.format(group,interface))
+
+    def close(self,send_control_signal=True):
+        super().close(send_control_signal and self.status_for_sending) # only the sender signals closing
+        self._groups = []
+
     def reopen(self,operation='receiving'):
         if not(self.is_open):
             if operation == 'receiving':
@@ -221,40 +530,106 @@ class Udp(__Connect):
             elif operation == 'sending':
                 self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 self.connect_for_sending()
+            elif operation == 'publishing':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.connect_for_publishing()
+            elif operation == 'subscribing':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.connect_for_subscribing()
             else:
                 self.log('ERROR - Unknown operation:{:s}'.format(operation))
 
+    def _peek(self,n):
+        try:
+            return self._socket.recv(n, socket.MSG_PEEK)
+        except OSError: # Windows raises on truncated datagrams
+            return self._socket.recv(self.max_datagram_size, socket.MSG_PEEK)[:n]
+
+    def _recv_message(self,n):
+        d, self._peer_address = self._socket.recvfrom(n)
+        return d
+
+    def _peek_control_signal(self):
+        d = self._peek(self._control_signal['n_bytes']+1)
+        if len(d) == self._control_signal['n_bytes']: return d # the whole datagram
+
+    def _send_message(self,d):
+        if self.status_for_sending: self._socket.send(d)
+        else: self._socket.sendto(d, self._peer_address) # reply to the sender
+
+    def _send_array_buffers(self,header,payload):
+        # the array is chunked into datagrams, each with a chunk header (array id, offset); the first also carries the array header
+        self._array_id = (self._array_id + 1) % 2**32
+        n = self.max_datagram_size - len(header) - _chunk_header.size
+        self._sendmsg([header, _chunk_header.pack(CHUNK_MAGIC, self._array_id, 0), payload[:n]])
+        m = self.max_datagram_size - _chunk_header.size
+        for i in range(n,len(payload),m):
+            self._sendmsg([_chunk_header.pack(CHUNK_MAGIC, self._array_id, i), payload[i:i+m]])
+
+    def _peek_array_header(self):
+        return self._peek(_array_header.size).ljust(_array_header.size,b'\0')
+
+    def _receive_array_buffers(self,payload):
+        chunk = bytearray(_chunk_header.size)
+        n = self._recvmsg_into([bytearray(_array_header.size), chunk, payload[:self.max_datagram_size-_array_header.size-_chunk_header.size]]) - _array_header.size - _chunk_header.size
+        magic, array_id, offset = _chunk_header.unpack(chunk)
+        if magic != CHUNK_MAGIC or n < 0:
+            self.log('ERROR - Array from {:s} has no chunk header!'.format(self.remote_address))
+            return False
+        while n < len(payload):
+            if not(self._wait_to_receive()):
+                self.log('ERROR - Array from {:s} is incomplete ({:d} of {:d} bytes)!'.format(self.remote_address,n,len(payload)))
+                return False
+            magic, i, offset = _chunk_header.unpack(self._peek(_chunk_header.size).ljust(_chunk_header.size,b'\0'))
+            if magic != CHUNK_MAGIC or i != array_id: # e.g. the next array: left for the next call
+                self.log('ERROR - Array from {:s} is incomplete ({:d} of {:d} bytes), dropped!'.format(self.remote_address,n,len(payload)))
+                return False
+            if offset != n: # lost chunk: the rest of this array is dropped
+                self.log('ERROR - Array from {:s} is incomplete (chunk at {:d} is missing), dropped!'.format(self.remote_address,n))
+                while self.ready_to_receive() and _chunk_header.unpack(self._peek(_chunk_header.size).ljust(_chunk_header.size,b'\0'))[:2] == (CHUNK_MAGIC, array_id):
+                    self._discard_message()
+                return False
+            n += self._recvmsg_into([chunk, payload[n:n+self.max_datagram_size-_chunk_header.size]]) - _chunk_header.size
+        return True
+
+    def _discard_message(self):
+        self._socket.recv(self.max_datagram_size)
+
     def receive_data(self,n=0,dtype='str'):
         if not(self.status_for_receiving):
             self.log('ERROR - Connection with {:s} is not ready for receiving!'.format(self.remote_address))
             return
     
         dat = []
+        new_message = True
         while not(n) or len(dat) < (n+self.sending_time_stamp):
             if self.ready_to_receive():
+                if self._handle_clock_message(): continue
 
                 # check for closing signal
-                try:
-                    if self._control_signal['decode'](self._socket.recv(self._control_signal['n_bytes'], socket.MSG_PEEK)) == self.control_signal:
-                        self.close(self.wait_for_controlsignal)
-                        return dat
-                except: pass
+                if self._is_control_signal():
+                    self.close(self.wait_for_controlsignal)
+                    return dat
 
-
-                if self.sending_time_stamp and not(len(dat)):
-                    dat += [datetime.fromtimestamp(struct.unpack(byteorder+'1f',self._socket.recv(4))[0])]
+                if new_message:
+                    new_message = False
+                    self._stats['messages_received'] += 1
+                    if self.sending_sequence_number:
+                        self._track_sequence(self._formats['uint']['decode'](self._socket.recv(self._formats['uint']['n_bytes'])))
+                        self._stats['bytes_received'] += self._formats['uint']['n_bytes']
+                    if self.sending_time_stamp:
+                        dat += [self._decode_time_stamp(self._formats['double']['decode'](self._socket.recv(self._formats['double']['n_bytes'])))]
+                        self._stats['bytes_received'] += self._formats['double']['n_bytes']
            
                 d = self._socket.recv(1024)
+                self._stats['bytes_received'] += len(d)
                 if len(d) % 4: dtype = 'str' # Cave: No 4(-8-12-16-...)-char-long string is allowed
                 
                 if dtype == 'str': dat += [d.decode(self.encoding)]
                 elif dtype == 'int': dat += list(struct.unpack(byteorder+str(n)+'i',d))
                 elif dtype == 'float': dat += list(struct.unpack(byteorder+str(n)+'f',d))
 
-            else:
-                t0 = datetime.now()
-                while not(self.ready_to_receive()) and ((datetime.now() - t0).total_seconds() < self.timeout): pass
-                if not(self.ready_to_receive()): break
+            elif not(self._wait_to_receive()): break
         return dat
 
 class Tcp(__Connect):
@@ -280,10 +655,23 @@ class Tcp(__Connect):
 
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         
-    def open_as_server(self):
-        self._socket.bind(('', self.port))
-        self._socket.listen(1)
-        self._socket, addr = self._socket.accept()
+    @staticmethod
+    def listen(port=1234,backlog=5,host='127.0.0.1'):
+        # listening socket for a server of several clients: Tcp(port=port).open_as_server(listener) for each
+        # host: local clients only by default, '' for all interfaces
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(backlog)
+        return listener
+
+    def open_as_server(self,listener=None):
+        if listener is None:
+            self._socket.bind(('', self.port))
+            self._socket.listen(1)
+            listener = self._socket
+        else: self._socket.close()
+        self._socket, addr = listener.accept()
         self._status = -1
         if not(self.IP is None):
             self._is_IP_confirmed = addr[0] == self.IP
@@ -295,6 +683,51 @@ class Tcp(__Connect):
         self._status = 1
         self._is_IP_confirmed = True
         self.log('{:s}; connected to server at {:s}:{:d}'.format(self.status,self.IP,self.port))
+
+    def reopen(self,operation='client'):
+        if not(self.is_open):
+            if operation == 'client':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.open_as_client()
+            elif operation == 'server':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.open_as_server()
+            else:
+                self.log('ERROR - Unknown operation:{:s}'.format(operation))
+
+    def _send_array_buffers(self,header,payload):
+        buffers = [memoryview(header), payload]
+        while len(buffers):
+            n = self._sendmsg(buffers)
+            while len(buffers) and n >= len(buffers[0]):
+                n -= len(buffers.pop(0))
+            if len(buffers): buffers[0] = buffers[0][n:]
+
+    def _peek(self,n):
+        return self._socket.recv(n, socket.MSG_PEEK)
+
+    def _recv_message(self,n):
+        d = bytearray(n)
+        if self._receive_array_buffers(memoryview(d)): return bytes(d)
+
+    def _send_message(self,d):
+        self._socket.sendall(d)
+
+    def _peek_array_header(self):
+        return self._recv_message(_array_header.size)
+
+    def _receive_array_buffers(self,payload):
+        n = 0
+        while n < len(payload):
+            if not(self._wait_to_receive()):
+                self.log('ERROR - Array from {:s} is incomplete ({:d} of {:d} bytes)!'.format(self.remote_address,n,len(payload)))
+                return False
+            d = self._socket.recv_into(payload[n:])
+            if not(d):
+                self.log('ERROR - Connection with {:s} is closed!'.format(self.remote_address))
+                return False
+            n += d
+        return True
     
     def receive_data(self,n=0,dtype=None):
         if not(self.status_for_receiving):
@@ -309,28 +742,493 @@ class Tcp(__Connect):
 
                 # only at the beginning)
                 if not(n_received):
+                    if self._handle_clock_message(): continue
+
                     # - check for closing signal
-                    try:
-                        if self._control_signal['decode'](self._socket.recv(self._control_signal['n_bytes'], socket.MSG_PEEK)) == self.control_signal:
-                            self.close(self.wait_for_controlsignal)
-                            return dat
-                    except: pass
+                    if self._is_control_signal():
+                        self.close(self.wait_for_controlsignal)
+                        return dat
+
+                    self._stats['messages_received'] += 1
+
+                    # - check for sequence number
+                    if self.sending_sequence_number:
+                        d = self._recv_message(self._formats['uint']['n_bytes'])
+                        if d is None: return dat # closed or timed out
+                        self._track_sequence(self._formats['uint']['decode'](d))
+                        self._stats['bytes_received'] += self._formats['uint']['n_bytes']
 
                     # - check for time stamp
                     if self.sending_time_stamp:
-                        ts = [datetime.fromtimestamp(self._formats['float']['decode'](self._socket.recv(self._formats['float']['n_bytes'])))]
+                        d = self._recv_message(self._formats['double']['n_bytes'])
+                        if d is None: return dat
+                        ts = [self._decode_time_stamp(self._formats['double']['decode'](d))]
+                        self._stats['bytes_received'] += self._formats['double']['n_bytes']
            
-                if dtype is None: dat += [self._socket.recv(1)]
-                elif dtype == 'str': dat += self._socket.recv(1).decode(self.encoding)
-                else: dat += [self._formats[dtype]['decode'](self._socket.recv(self._formats[dtype]['n_bytes']))]
+                if dtype is None: dat += [self._socket.recv(1)]; self._stats['bytes_received'] += 1
+                elif dtype == 'str': dat += self._socket.recv(1).decode(self.encoding); self._stats['bytes_received'] += 1
+                else: 
+                    dat += [self._formats[dtype]['decode'](self._socket.recv(self._formats[dtype]['n_bytes']))]
+                    self._stats['bytes_received'] += self._formats[dtype]['n_bytes']
                 n_received += 1
-            else:
-                t0 = datetime.now()
-                while not(self.ready_to_receive()) and ((datetime.now() - t0).total_seconds() < self.timeout): pass
-                if not(self.ready_to_receive()): break
+            elif not(self._wait_to_receive()): break
         
         if self.sending_time_stamp:
             if dtype == 'str': dat = ts + [dat]
             else: dat = ts + dat
 
-        return dat
\ No newline at end of file
+        return dat
+
+
+class Shm(__Connect):
+    # Same-host transport: single-producer/single-consumer ring buffer in named shared memory.
+    # The receiver is woken by a 1-byte loopback UDP "doorbell", which is only sent when it is waiting.
+    # Records: length (uint32), type (uint8), padding; payload aligned to 8 bytes.
+
+    _record = struct.Struct('<IB3x')
+    _message = struct.Struct('<Id') # sequence number, time stamp
+    _ring_header = 64 # write position, read position, receiver is waiting, capacity (uint64)
+    REC_MESSAGE, REC_STR, REC_INT, REC_FLOAT, REC_ARRAY, REC_CONTROL, REC_WRAP = range(7)
+    WAIT_SLICE = 0.01 # s, re-check of the ring while waiting for the doorbell
+    _created = set() # names created by receivers of this process
+
+    @property
+    def status(self):
+        if self._status == -1:
+            return 'ready for receiving'
+        elif self._status == 1:
+            return 'ready for sending'
+        else: # 0
+            return 'closed'
+
+    @property
+    def status_for_sending(self):
+        return self.status == 'ready for sending'
+
+    @property
+    def status_for_receiving(self):
+        return self.status == 'ready for receiving'
+
+    @property
+    def remote_address(self):
+        return 'shared memory "{:s}"'.format(self.name)
+
+    def __init__(self,name='pyniexp',port=1235,encoding='UTF-8',control_signal='#',timeout=20,capacity=2**20):
+        # port: of the doorbell, not to clash with Udp (1234) on the same host
+        super().__init__('127.0.0.1',port,encoding,control_signal,timeout)
+
+        self.name = name
+        self.capacity = (capacity + 7) // 8 * 8
+
+        self._shm = None
+        self._position = None # write, read, waiting, capacity
+        self._data = None
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # doorbell
+
+    def connect_for_receiving(self):
+        try:
+            self._shm = shared_memory.SharedMemory(self.name, create=True, size=self._ring_header+self.capacity)
+        except FileExistsError: # left over
+            shared_memory.SharedMemory(self.name).unlink()
+            self._shm = shared_memory.SharedMemory(self.name, create=True, size=self._ring_header+self.capacity)
+        self._created.add(self.name)
+        self._map()
+        self._position[:] = [0, 0, 0, self.capacity]
+
+        self._socket.bind((self.IP, self.port))
+        self._socket.setblocking(False)
+        self._status = -1
+
+        if len(self.control_signal):
+            rec = None
+            while rec is None or rec[0] != self.REC_CONTROL:
+                rec = self._read_record()
+                if not(rec is None): self._position[1] = rec[3]
+        self._is_IP_confirmed = True
+        self.log('Connection with {:s} is {:s}'.format(self.remote_address,self.status))
+
+    def connect_for_sending(self):
+        t0 = time_stamp()
+        while self._shm is None:
+            try:
+                try:
+                    self._shm = shared_memory.SharedMemory(self.name, track=False)
+                except TypeError: # Python < 3.13: the receiver owns (and unlinks) the memory
+                    self._shm = shared_memory.SharedMemory(self.name)
+                    if not(self.name in self._created): # the tracker is per process
+                        try: resource_tracker.unregister(self._shm._name, 'shared_memory')
+                        except Exception: pass
+            except FileNotFoundError:
+                if time_stamp() - t0 > self.timeout:
+                    self.log('ERROR - Establishing connection for sending with {:s} failed: no receiver'.format(self.remote_address))
+                    return
+                sleep(0.01)
+        self._map()
+        self.capacity = int(self._position[3])
+
+        self._socket.connect((self.IP, self.port))
+        self._status = 1
+        self._is_IP_confirmed = True
+
+        if len(self.control_signal): self._write_record(self.REC_CONTROL)
+        self.log('Connection with {:s} is {:s}'.format(self.remote_address,self.status))
+
+    def close(self,send_control_signal=True):
+        if self.is_open:
+            if len(self.control_signal) and send_control_signal and self.status_for_sending: self._write_record(self.REC_CONTROL)
+
+            self._socket.close()
+            self._position = None; self._data = None # release views before closing the memory
+            self._shm.close()
+            if self.status_for_receiving: 
+                self._shm.unlink()
+                self._created.discard(self.name)
+            self._shm = None
+            self._status = 0
+            self.log('Connection closed with {:s}'.format(self.remote_address))
+
+    def reopen(self,operation='receiving'):
+        if not(self.is_open):
+            if operation == 'receiving':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.connect_for_receiving()
+            elif operation == 'sending':
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.connect_for_sending()
+            else:
+                self.log('ERROR - Unknown operation:{:s}'.format(operation))
+
+    def ready_to_receive(self):
+        return self.status_for_receiving and int(self._position[0]) != int(self._position[1])
+
+    def flush(self):
+        if self.status_for_receiving: self._position[1] = self._position[0]
+
+    def synchronise_clock(self,n=8):
+        # same host: time stamps come from the same monotonic clock
+        self.clock_offset, self.clock_delay = 0, 0
+        return self.clock_offset, self.clock_delay
+
+    def send_data(self,dat):
+        if not(self.status_for_sending):
+            self.log('ERROR - Connection with {:s} is not ready for sending!'.format(self.remote_address))
+            return
+
+        if type(dat) != list: dat = [dat]
+
+        t = datetime.now()
+        n_bytes = self._write_record(self.REC_MESSAGE, self._message.pack(self._next_sequence() if self.sending_sequence_number else 0, time_stamp()))
+        if not(n_bytes): return # full
+        for d in dat:
+            if type(d) == str: n = self._write_record(self.REC_STR, d.encode(self.encoding))
+            elif type(d) == int: n = self._write_record(self.REC_INT, struct.pack('<q',d))
+            elif type(d) == float: n = self._write_record(self.REC_FLOAT, struct.pack('<d',d))
+            else:
+                self.log('ERROR - Data of type {:s} cannot be sent!'.format(type(d).__name__))
+                return
+            if not(n): return
+            n_bytes += n
+
+        self._stats['messages_sent'] += 1
+        self._stats['bytes_sent'] += n_bytes
+        return t, len(dat)
+
+    def receive_data(self,n=0,dtype=None):
+        # records are typed, dtype is accepted for compatibility with Udp/Tcp
+        if not(self.status_for_receiving):
+            self.log('ERROR - Connection with {:s} is not ready for receiving!'.format(self.remote_address))
+            return
+
+        dat = []
+        while not(n) or len(dat) < (n+self.sending_time_stamp):
+            rec = self._read_record()
+            if rec is None: break
+            rtype, offset, length, next_position = rec
+
+            if rtype == self.REC_CONTROL:
+                self._position[1] = next_position
+                self.close(self.wait_for_controlsignal)
+                return dat
+            elif rtype == self.REC_MESSAGE:
+                seq, ts = self._message.unpack_from(self._data, offset)
+                self._stats['messages_received'] += 1
+                if self.sending_sequence_number: self._track_sequence(seq)
+                if self.sending_time_stamp: dat += [self._decode_time_stamp(ts)]
+            elif rtype == self.REC_STR: dat += [bytes(self._data[offset:offset+length]).decode(self.encoding)]
+            elif rtype == self.REC_INT: dat += [struct.unpack_from('<q', self._data, offset)[0]]
+            elif rtype == self.REC_FLOAT: dat += [struct.unpack_from('<d', self._data, offset)[0]]
+            elif rtype == self.REC_ARRAY: dat += [self._decode_array(offset)]
+            self._stats['bytes_received'] += length
+            self._position[1] = next_position
+        return dat
+
+    def receive_array(self,out=None):
+        if not(self.status_for_receiving):
+            self.log('ERROR - Connection with {:s} is not ready for receiving!'.format(self.remote_address))
+            return
+
+        rec = self._read_record()
+        if rec is None: return
+        rtype, offset, length, next_position = rec
+
+        if rtype == self.REC_CONTROL:
+            self._position[1] = next_position
+            self.close(self.wait_for_controlsignal)
+            return
+        elif rtype != self.REC_ARRAY:
+            self.log('ERROR - No array received from {:s}!'.format(self.remote_address))
+            return
+
+        ts, seq = _array_header.unpack_from(self._data, offset)[3:5]
+        out = self._decode_array(offset,out)
+        self._position[1] = next_position
+
+        self._stats['messages_received'] += 1
+        self._stats['bytes_received'] += length
+        if self.sending_sequence_number: self._track_sequence(seq)
+        if self.sending_time_stamp: return [self._decode_time_stamp(ts), out]
+        else: return out
+
+    def _map(self):
+        self._position = np.ndarray((4,), dtype=np.uint64, buffer=self._shm.buf)
+        self._data = self._shm.buf[self._ring_header:]
+
+    def _send_array_buffers(self,header,payload):
+        return self._write_record(self.REC_ARRAY, header, bytes(-len(header) % 8), payload) > 0 # array data aligned to 8 bytes
+
+    def _decode_array(self,offset,out=None):
+        magic, dt, ndim, ts, seq, *shape = _array_header.unpack_from(self._data, offset)
+        dt = np.dtype(dt.rstrip(b'\0').decode())
+        shape = tuple(shape[:ndim])
+        src = np.frombuffer(self._data, dtype=dt, count=int(np.prod(shape)), 
+            offset=offset + (_array_header.size + 7) // 8 * 8).reshape(shape)
+        if out is None or out.dtype != dt or out.shape != shape: return src.copy()
+        np.copyto(out, src)
+        return out
+
+    def _write_record(self,rtype,*parts):
+        n = sum([len(p) for p in parts])
+        size = (self._record.size + n + 7) // 8 * 8
+        if size > self.capacity:
+            self.log('ERROR - Data of {:d} bytes does not fit into {:s}!'.format(n,self.remote_address))
+            return 0
+
+        w = int(self._position[0])
+        offset = w % self.capacity
+        tail = self.capacity - offset
+
+        t0 = time_stamp()
+        if tail < size: # continue at the beginning: the wrap marker is published first, so that only size is needed there
+            if not(self._wait_for_space(w,tail,t0)): return 0
+            self._record.pack_into(self._data, offset, tail - self._record.size, self.REC_WRAP)
+            w += tail
+            self._position[0] = w
+            offset = 0
+        if not(self._wait_for_space(w,size,t0)): return 0
+
+        self._record.pack_into(self._data, offset, n, rtype)
+        o = offset + self._record.size
+        for p in parts:
+            self._data[o:o+len(p)] = p
+            o += len(p)
+        self._position[0] = w + size # publish
+
+        if self._position[2]: self._socket.send(b'\0') # wake up the receiver
+        return n
+
+    def _wait_for_space(self,w,need,t0):
+        while self.capacity - (w - int(self._position[1])) < need: # full: wait for the receiver
+            if time_stamp() - t0 > self.timeout:
+                self.log('ERROR - {:s} is full!'.format(self.remote_address))
+                return False
+            sleep(0.0001)
+        return True
+
+    def _read_record(self):
+        # (type, payload offset, payload length, next read position) of the next record, or None on timeout
+        while True:
+            r = int(self._position[1])
+            if int(self._position[0]) == r:
+                if not(self._wait_for_record()): return
+                continue
+
+            offset = r % self.capacity
+            n, rtype = self._record.unpack_from(self._data, offset)
+            if rtype == self.REC_WRAP:
+                self._position[1] = r + self.capacity - offset
+                continue
+            return rtype, offset + self._record.size, n, r + (self._record.size + n + 7) // 8 * 8
+
+    def _wait_for_record(self):
+        t0 = time_stamp()
+        while int(self._position[0]) == int(self._position[1]):
+            remaining = self.timeout - (time_stamp() - t0)
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                return False
+
+            # announce waiting, then re-check to avoid missing a record written in between
+            self._position[2] = 1
+            if int(self._position[0]) == int(self._position[1]):
+                select([self._socket],[],[],min(remaining,self.WAIT_SLICE))
+            self._position[2] = 0
+            try:
+                while self._socket.recv(64): pass # drain doorbells
+            except (BlockingIOError, OSError): pass
+        return True
+
+
+
+class AsyncSender:
+    # Non-blocking sender: payloads are handed to a background I/O thread through a bounded backlog.
+    # The thread (re)connects with exponential backoff, so a stalled or restarting receiver never blocks the caller.
+    # After construction, the connection MUST only be used through this object.
+    # The thread keeps the object alive: call close() (or use it in a with statement); at exit, it is closed automatically.
+    OVERFLOW = ['drop_oldest', 'drop_newest', 'block']
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    @property
+    def is_connected(self):
+        return self.connection.is_open
+
+    def __init__(self,connection,maxsize=64,overflow='drop_oldest',reconnect_delay=(0.1, 5)):
+        assert overflow in self.OVERFLOW, "overflow MUST be one of {}".format(self.OVERFLOW)
+        self.connection = connection
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.reconnect_delay = reconnect_delay # initial and maximum backoff [s]
+
+        # flags reset by (re)connecting
+        self._flags = (connection.sending_time_stamp, connection.sending_sequence_number)
+
+        self._queue = deque()
+        self._condition = Condition()
+        self._closing = False
+        self._is_failing = False
+        self.reset_stats()
+
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def send_data(self,dat):
+        return self._put(('data', dat))
+
+    def send_array(self,arr,copy=True):
+        # copy=False only if the caller does not modify the array until it is sent
+        return self._put(('array', np.array(arr,copy=True) if copy else arr))
+
+    def stats(self):
+        s = dict(self._stats)
+        s['queue_depth'] = self.queue_depth
+        s['send_latency'] = self._send_latency.summary()
+        s['enqueue_latency'] = self._enqueue_latency.summary()
+        s['connection'] = self.connection.stats()
+        return s
+
+    def reset_stats(self):
+        self._stats = dict.fromkeys(['queued', 'sent', 'dropped', 'errors', 'reconnects'], 0)
+        self._send_latency = Histogram() # enqueue -> sent
+        self._enqueue_latency = Histogram() # cost for the caller
+
+    def close(self,timeout=None):
+        # sends the backlog (if connected) before closing the connection
+        if self._closing: return
+        atexit.unregister(self.close)
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(self.connection.timeout if timeout is None else timeout)
+        try:
+            if self.connection.is_open: self.connection.close()
+        except OSError: # receiver is gone
+            self.connection.close(send_control_signal=False)
+
+    def _put(self,item):
+        t = time_stamp()
+        with self._condition:
+            if self._closing: return False
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == 'drop_newest':
+                    self._stats['dropped'] += 1
+                    return False
+                elif self.overflow == 'drop_oldest':
+                    self._queue.popleft()
+                    self._stats['dropped'] += 1
+                else: # block
+                    while len(self._queue) >= self.maxsize and not(self._closing): self._condition.wait()
+            self._queue.append(item + (t,))
+            self._stats['queued'] += 1
+            self._condition.notify_all()
+        self._enqueue_latency.add(time_stamp() - t)
+        return True
+
+    def _connect(self):
+        c = self.connection
+        c.quiet_failures = self._is_failing # failures are reported once
+        try:
+            if isinstance(c, Tcp): c.reopen('client')
+            elif isinstance(c, Udp) and c.is_multicast: c.reopen('publishing')
+            else: c.reopen('sending')
+        except (OSError, ValueError) as e: # ValueError: e.g. invalid address
+            c.log('WARNING - Connecting to {:s} failed: {} (retrying)'.format(c.remote_address,e))
+        if not(c.is_open): self._is_failing = True # until a message is sent
+        c.quiet_failures = self._is_failing
+        c.sending_time_stamp, c.sending_sequence_number = self._flags
+        return c.is_open
+
+    def _run(self):
+        delay = self.reconnect_delay[0]
+        while True:
+            # (re)connect
+            if not(self.connection.is_open):
+                if self._closing: break
+                if not(self._connect()):
+                    with self._condition: self._condition.wait(delay)
+                    delay = min(delay*2, self.reconnect_delay[1])
+                    continue
+                if self._stats['sent'] or self._stats['errors']: self._stats['reconnects'] += 1
+
+            with self._condition:
+                while not(len(self._queue)) and not(self._closing): self._condition.wait()
+                if not(len(self._queue)): break # closing and backlog is sent
+                item = self._queue.popleft()
+                self._condition.notify_all()
+
+            kind, payload, t = item
+            error = None
+            try:
+                if kind == 'data': ok = self.connection.send_data(payload)
+                else: ok = self.connection.send_array(payload)
+                if not(ok is None):
+                    self._stats['sent'] += 1
+                    self._send_latency.add(time_stamp() - t)
+                    self._is_failing = self.connection.quiet_failures = False
+                    delay = self.reconnect_delay[0]
+                    continue
+                elif self.connection.is_open: # not sendable (e.g. type) or the receiver does not keep up (Shm): reported by the connection
+                    self._stats['errors'] += 1
+                    self._stats['dropped'] += 1
+                    continue
+                error = 'not connected'
+            except OSError as e:
+                error = e
+
+            # retry after reconnecting, with backoff (e.g. no UDP receiver)
+            self._stats['errors'] += 1
+            self.connection.log('WARNING - Sending to {:s} failed: {} (retrying)'.format(self.connection.remote_address,error))
+            self._is_failing = self.connection.quiet_failures = True
+            self.connection.close(send_control_signal=False)
+            with self._condition:
+                self._queue.appendleft(item)
+                self._condition.wait(delay)
+            delay = min(delay*2, self.reconnect_delay[1])
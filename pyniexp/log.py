@@ -0,0 +1,116 @@
+import os, sys, atexit, traceback
+from datetime import datetime
+from time import time
+from threading import Thread
+from multiprocessing import Queue
+
+# Package-wide logging: records are put into a multiprocessing queue and written by a single background thread
+# of the process that created the queue (the main process). The caller only pays for the put.
+# - Disabled levels are bound to a no-op, so filtered calls cost a function call.
+# - Formatting is lazy: logger.info('volume {:d}', n) is formatted by the writer.
+# - every=<seconds> rate-limits a message (per template) and reports how many were suppressed.
+# Child processes started with fork share the queue; with spawn, pass logger.queue to the child and call logger.attach().
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+NAMES = {v: k for k, v in LEVELS.items()}
+
+def _noop(*args, **kwargs): pass
+
+class Logger:
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self,val):
+        if type(val) == str: val = LEVELS[val.upper()]
+        self._level = val
+        for name, lvl in LEVELS.items():
+            self.__dict__[name.lower()] = (lambda msg, *args, _lvl=lvl, **kwargs: self.log(_lvl, msg, *args, **kwargs)) if lvl >= val else _noop
+
+    @property
+    def queue(self):
+        if self._queue is None: self._queue = Queue() # created on first use, not to fix the start method at import
+        return self._queue
+
+    def __init__(self,level='INFO',sink=None):
+        self.sink = sink # file-like object or callable accepting a string (default: sys.stdout at the time of writing)
+        self._queue = None
+        self._owner = os.getpid()
+        self._writer = None
+        self._closed = False # at exit, the rest is written synchronously
+        self._rate = {}
+        self.level = level
+
+    def attach(self,queue):
+        # use the queue of another (parent) process
+        self._queue = queue
+        self._owner = None
+
+    def log(self,level,msg,*args,every=None):
+        if type(level) == str: level = LEVELS[level.upper()]
+        if level < self._level: return
+
+        t = time()
+        suppressed = 0
+        if not(every is None):
+            last, suppressed = self._rate.get(msg, (0, 0))
+            if t - last < every:
+                self._rate[msg] = (last, suppressed+1)
+                return
+            self._rate[msg] = (t, 0)
+
+        if self._closed and self._owner == os.getpid(): # best effort, the interpreter may be shutting down
+            try: self._emit((t, level, os.getpid(), msg, args, suppressed))
+            except Exception: pass
+            return
+        queue = self.queue
+        if self._writer is None and self._owner == os.getpid(): self._start()
+        queue.put_nowait((t, level, os.getpid(), msg, args, suppressed))
+
+    def exception(self,msg,*args):
+        # formats the traceback immediately, the exception is gone by the time the writer gets the record
+        tb = traceback.format_exc().rstrip()
+        if len(args): tb = tb.replace('{','{{').replace('}','}}') # the message is formatted only with args
+        self.log(LEVELS['ERROR'], msg + '\n' + tb, *args)
+
+    def flush(self,timeout=1):
+        if self._writer is None: return
+        self._queue.put(None)
+        self._writer.join(timeout)
+        self._writer = None
+
+    def _start(self):
+        self._writer = Thread(target=self._write, daemon=True)
+        self._writer.start()
+        atexit.register(self._close)
+
+    def _close(self):
+        self._closed = True # no new writer from now on
+        self.flush()
+
+    def _write(self):
+        while True:
+            try: rec = self._queue.get()
+            except (EOFError, OSError): break # queue closed at exit
+            if rec is None: break
+            self._emit(rec)
+
+    def _emit(self,rec):
+        t, level, pid, msg, args, suppressed = rec
+        try:
+            if len(args): msg = msg.format(*args)
+        except Exception as e:
+            msg = '{} {} (formatting failed: {})'.format(msg, args, e)
+        if suppressed: msg += ' ({:d} similar message(s) suppressed)'.format(suppressed)
+        line = '{:s} | {:<8s} | {:d} | {:s}\n'.format(
+            datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], NAMES.get(level, str(level)), pid, msg)
+
+        sink = sys.stdout if self.sink is None else self.sink
+        if callable(sink): sink(line)
+        else:
+            sink.write(line)
+            sink.flush()
+
+logger = Logger()
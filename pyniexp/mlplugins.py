@@ -1,6 +1,8 @@
-from numpy import array, prod, flip
-from multiprocessing import Process, Value, RawArray
-from loguru import logger
+from time import perf_counter
+from numpy import prod, frombuffer, asarray, linspace
+from multiprocessing import Process, Queue, Value, RawValue, RawArray, Lock, Condition
+from pyniexp.log import logger
+from pyniexp.utils import Histogram
 from matlab import double
 
 SIG_NOTSTARTED = -1
@@ -8,18 +10,144 @@ SIG_RUNNING = 1
 SIG_STOPPED = 0
 SIG_NEWIMAGE = 10
 
+# Slot states of the ring buffer
+SLOT_FREE = 0
+SLOT_WRITING = 1
+SLOT_READY = 2
+SLOT_PROCESSING = 3
+SLOT_DONE = 4 # waiting for reduction
+
+# Policies when all slots are taken
+POLICIES = ['block', 'drop_oldest', 'drop_newest']
+
+def _as_array(data):
+    # view of a buffer-protocol object as float64 data (no copy)
+    if type(data) == double: data = data._data # matlab array: flat, column-major array.array('d')
+    if isinstance(data,(bytes,bytearray)) or (isinstance(data,memoryview) and data.format in 'Bbc'):
+        return frombuffer(data,dtype='float64')
+    return asarray(data)
+
 class dataProcess:
-    __process = Process()
+    # Data are handed over in a ring of n_slots shared buffers, and processed in the order of loading (sequence number).
+    # A slot is not overwritten while it is being processed. When all slots are taken, load_data
+    #   - 'block': waits for a free slot
+    #   - 'drop_oldest': replaces the oldest unprocessed data (latest data win, as with a single buffer)
+    #   - 'drop_newest': discards the new data
+    # The worker sleeps on a condition until data are loaded or the process is stopped (no polling).
+    # With n_workers > 1, the workers process the data (or the parts of the data) in parallel, and the results of process()
+    # are passed to reduce() in the order of loading by a single process, so reduce() may keep state.
+    # With result_shape, the output for each data (return value of reduce() if overridden, otherwise of process()) is published
+    # in shared memory with its sequence number for the producer (get_result). The last n_results outputs are kept.
+    __processes = []
+    _data = None
+    _output = None
+    _data_name = 'data'
+    _n_parts = 1 # number of parts each data are split into for process()
+    _results = None
+    n_results = 16
+
+    @property
+    def data(self):
+        # NumPy view over the shared buffer: n_slots x data_size
+        if self._data is None: self._data = frombuffer(self._buffer,dtype='float64').reshape(self.n_slots,-1)
+        return self._data
+
+    @property
+    def output(self):
+        # NumPy view over the shared results: n_results x result size
+        if self._output is None: self._output = frombuffer(self._output_buffer,dtype='float64').reshape(self.n_results,-1)
+        return self._output
+
+    @property
+    def is_alive(self):
+        return any(p.is_alive() for p in self.__processes)
+
+    @property
+    def _reducing(self):
+        return type(self).reduce is not dataProcess.reduce
+
+    @property
+    def loaded(self):
+        return self._loaded.value
+
+    @property
+    def processed(self):
+        return self._processed.value
+
+    @property
+    def dropped(self):
+        # number of data discarded because all slots were taken
+        return self._dropped.value
+
+    @property
+    def late(self):
+        # number of data processed while newer data were already waiting
+        return self._late.value
+
+    @property
+    def queued(self):
+        with self._lock: return sum(s == SLOT_READY for s in self._state)
 
-    def __init__(self,data_size,autostart=True):
-        self._buffer = RawArray('d',[0]*data_size)
+    @property
+    def latest_result(self):
+        # sequence number of the latest published output
+        return self._latest_result.value
+
+    def __init__(self,data_size,autostart=True,n_slots=4,policy='drop_oldest',n_workers=1,result_shape=None):
+        if policy not in POLICIES: raise ValueError('Unknown policy {}; choose from {}'.format(policy,POLICIES))
+        self.n_slots = n_slots
+        self.n_workers = n_workers
+        self.policy = policy
+        self._buffer = RawArray('d',int(data_size)*n_slots)
+        self._seq = RawArray('q',[-1]*n_slots) # sequence number of the data in each slot
+        self._state = RawArray('b',n_slots)
+        self._part_next = RawArray('i',n_slots) # next part to process
+        self._part_done = RawArray('i',n_slots)
+        self._lock = Lock()
+        self._ready = Condition(self._lock) # notified on new data, free slot and stop
+        self._published = Condition(self._lock) # notified on new output
+        self._load_time = RawArray('d',n_slots)
+        self._ready_time = RawArray('d',n_slots)
+        self.wakeup_latency = Histogram(shared=True) # all histograms are updated with the lock
+        self.load_latency = Histogram(shared=True)
+        self.queue_latency = Histogram(shared=True)
+        self.compute_latency = Histogram(shared=True)
+        self.total_latency = Histogram(shared=True)
+        self.result_shape = result_shape
+        if not(result_shape is None):
+            self._output_buffer = RawArray('d',int(prod(result_shape))*self.n_results)
+            self._output_seq = RawArray('q',[-1]*self.n_results)
+            self._output_ok = RawArray('b',self.n_results) # False if there is no valid output (e.g. dropped)
+        self._latest_result = RawValue('q',-1)
+        self._loaded = RawValue('q',0) # also the next sequence number
+        self._processed = RawValue('q',0)
+        self._dropped = RawValue('q',0)
+        self._late = RawValue('q',0)
+        self.sequence = -1 # sequence number of the data being processed or reduced (in the worker)
+        self.part = 0 # part being processed (in the worker)
+        self.worker = 0 # index of the worker (in the worker)
         self._signal = Value('b',SIG_NOTSTARTED)
+        self._log_queue = logger.queue # child processes log through the main process
         if autostart: self.start_process()
 
     def __del__(self):
-        if self._signal.value != SIG_STOPPED:
-            logger.info('Stopping process')
-            self._signal.value = SIG_STOPPED
+        self.stop_process()
+
+    def __getstate__(self):
+        # for the child processes (spawn): neither the process handles nor the views of the shared buffers (rebuilt on access)
+        state = self.__dict__.copy()
+        for key in ['_dataProcess__processes', '_data', '_output', '_images']: state.pop(key,None)
+        return state
+
+    def stats(self):
+        return {
+            'loaded': self.loaded, 'processed': self.processed, 'dropped': self.dropped, 'late': self.late,
+            'wakeup_latency': self.wakeup_latency.summary(), # data ready -> idle worker running [s]
+            'load_latency': self.load_latency.summary(), # load_data [s]
+            'queue_latency': self.queue_latency.summary(), # data ready -> processing started [s]
+            'compute_latency': self.compute_latency.summary(), # process() [s]
+            'total_latency': self.total_latency.summary() # load_data -> processed (and reduced) [s]
+        }
 
     # Processing
     def process(self,data):
@@ -30,52 +158,234 @@ class dataProcess:
         """Process finalization method to overwrite"""
         return NotImplemented
 
+    def reduce(self,result):
+        """Sequential reduction method to overwrite: receives the result(s) of process() in the order of loading (list of parts if split)"""
+        return NotImplemented
+
+    def finalize_reduce(self):
+        """Reduction finalization method to overwrite"""
+        return NotImplemented
+
     # Mechanism
     def start_process(self):
         logger.info('Starting process')
-        self.__process = Process(target=self._run)
-        self.__process.start()
+        self._pending = {} # results waiting for reduction: sequence number -> {part: result}
+        if self._reducing and self.n_workers > 1: self._results = Queue()
+        processes = [Process(target=self._run,args=(w,)) for w in range(self.n_workers)]
+        if not(self._results is None): processes.append(Process(target=self._run_reducer))
+        for p in processes: p.start()
+        self.__processes = processes
+
+    def stop_process(self):
+        if self._signal.value != SIG_STOPPED:
+            logger.info('Stopping process')
+            with self._ready:
+                self._signal.value = SIG_STOPPED
+                self._ready.notify_all()
+                self._published.notify_all()
 
     def load_data(self,mlData):
-        if not(self.__process.is_alive()):
-            logger.exception('Process is not running')
+        # returns the sequence number, or None if the data are not loaded
+        t0 = perf_counter()
+        if not(self.is_alive):
+            logger.error('Process is not running')
             return
 
-        if type(mlData) == double: # matlab array
-            mlData = mlData._data.tolist()
-        elif type(mlData) == float: # single value
-            mlData = [mlData]
+        if not(isinstance(mlData,(float,int))): # matlab array, NumPy array, array.array, bytes, memoryview, etc.
+            mlData = _as_array(mlData)
+            if mlData.size != self.data.shape[1]:
+                logger.error('Data size ({:d}) does not match the buffer ({:d})', mlData.size, self.data.shape[1])
+                return
 
-        for l in range(0,len(self._buffer)): self._buffer[l] = mlData[l]
-        self._signal.value = SIG_NEWIMAGE
-    
-    def _run(self):
-        while self._signal.value != SIG_STOPPED:
+        with self._ready:
+            slot = self._reserve()
+            while slot is None and self.policy == 'block' and self.is_alive:
+                self._ready.wait(0.1) # re-check whether the worker is alive
+                slot = self._reserve()
+        if slot is None:
+            self._dropped.value += 1
+            logger.warning('All {:d} slots are taken; new data are dropped', self.n_slots, every=1)
+            return
+
+        if isinstance(mlData,(float,int)): # single value
+            self.data[slot,0] = mlData
+        else: # one bulk copy; multidimensional arrays are stored in column-major (MATLAB) order
+            self.data[slot].reshape(mlData.shape,order='F')[...] = mlData
+
+        with self._ready:
+            seq = self._loaded.value
+            self._seq[slot] = seq
+            self._state[slot] = SLOT_READY
+            self._load_time[slot] = t0
+            self._ready_time[slot] = perf_counter()
+            self.load_latency.add(self._ready_time[slot] - t0)
+            self._loaded.value += 1
+            self._ready.notify_all()
+        return seq
+
+    def _reserve(self):
+        # slot to write into (with the lock)
+        for slot in range(self.n_slots):
+            if self._state[slot] == SLOT_FREE: break
+        else:
+            ready = [s for s in range(self.n_slots) if self._state[s] == SLOT_READY]
+            if self.policy != 'drop_oldest' or not(len(ready)): return
+            slot = min(ready, key=lambda s: self._seq[s])
+            self._dropped.value += 1
+            logger.warning('All {:d} slots are taken; data #{:d} are dropped', self.n_slots, self._seq[slot], every=1)
+            self._set_result(self._seq[slot],None)
+        self._state[slot] = SLOT_WRITING
+        self._part_next[slot] = 0
+        self._part_done[slot] = 0
+        return slot
+
+    def _claim(self):
+        # oldest slot with a part to process (with the lock)
+        todo = [s for s in range(self.n_slots) if self._state[s] in [SLOT_READY, SLOT_PROCESSING] and self._part_next[s] < self._n_parts]
+        if not(len(todo)): return
+        slot = min(todo, key=lambda s: self._seq[s])
+        if self._state[slot] == SLOT_READY:
+            if sum(self._state[s] == SLOT_READY for s in todo) > 1: self._late.value += 1
+            self._state[slot] = SLOT_PROCESSING
+        part = self._part_next[slot]
+        self._part_next[slot] += 1
+        return slot, part
+
+    def _wait_for_data(self):
+        # next (slot, part) to process, or None when stopped
+        with self._ready:
+            waited = False
+            while self._signal.value != SIG_STOPPED:
+                claimed = self._claim()
+                if not(claimed is None):
+                    if claimed[1] == 0: self.queue_latency.add(perf_counter() - self._ready_time[claimed[0]])
+                    if waited: self.wakeup_latency.add(perf_counter() - self._ready_time[claimed[0]])
+                    return claimed
+                self._ready.wait()
+                waited = True
+
+    def _release(self,slot,compute):
+        # a part is processed; returns whether all parts are
+        with self._ready:
+            self.compute_latency.add(compute)
+            self._part_done[slot] += 1
+            if self._part_done[slot] < self._n_parts: return False
+            self._processed.value += 1
+            self._state[slot] = SLOT_DONE
+            return True
+
+    def _finish(self,slot,seq,result):
+        # publishes the output and frees the slot
+        with self._ready:
+            self.total_latency.add(perf_counter() - self._load_time[slot])
+            self._set_result(seq,result)
+            self._state[slot] = SLOT_FREE
+            self._ready.notify_all()
+
+    def _set_result(self,seq,result):
+        # (with the lock)
+        if self.result_shape is None: return
+        i = seq % self.n_results
+        ok = not(result is None or result is NotImplemented)
+        if ok:
+            result = asarray(result,dtype='float64')
+            ok = result.size == self.output.shape[1]
+            if ok: self.output[i] = result.reshape(-1)
+            else: logger.error('Result size ({:d}) does not match result_shape {}', result.size, self.result_shape)
+        self._output_seq[i] = seq
+        self._output_ok[i] = ok
+        if ok and seq > self._latest_result.value: self._latest_result.value = seq
+        self._published.notify_all()
+
+    def get_result(self,seq=None,timeout=None):
+        # output for data #seq (the latest if None), waiting up to timeout [s] (None: forever, 0: poll)
+        # returns None if not available, dropped or already overwritten
+        if self.result_shape is None:
+            logger.error('No result channel (result_shape is not specified)')
+            return
+        with self._published:
+            if seq is None: seq = self._latest_result.value
+            if seq < 0: return
+            i = seq % self.n_results
+            if not(self._published.wait_for(lambda: self._output_seq[i] >= seq or self._signal.value == SIG_STOPPED, timeout)): return
+            if self._output_seq[i] != seq or not(self._output_ok[i]): return
+            result = self.output[i].reshape(self.result_shape).copy()
+        if not(result.ndim): return float(result)
+        return result
+
+    def _deliver(self,seq,part,result):
+        # after _release, so that the slot is done by the time its last result arrives
+        self._pending.setdefault(seq,{})[part] = result
+
+        while True: # reduce the oldest data as long as they are complete
+            with self._ready:
+                busy = [s for s in range(self.n_slots) if self._state[s] in [SLOT_READY, SLOT_PROCESSING, SLOT_DONE]]
+                if not(len(busy)): return
+                slot = min(busy, key=lambda s: self._seq[s])
+                seq = self._seq[slot]
+                if self._state[slot] != SLOT_DONE or len(self._pending.get(seq,{})) < self._n_parts: return
+            results = self._pending.pop(seq)
+            self.sequence = seq
+            self._finish(slot,seq,self.reduce(results[0] if self._n_parts == 1 else [results[p] for p in range(self._n_parts)]))
+
+    def _get(self,slot,part=0):
+        return self.data[slot]
+
+    def _run(self,worker=0):
+        logger.attach(self._log_queue)
+        self.worker = worker
+        with self._ready:
             if self._signal.value == SIG_NOTSTARTED: 
                 logger.info('Process is running')
                 self._signal.value = SIG_RUNNING
-            if self._signal.value == SIG_NEWIMAGE:
-                logger.info('New data')
-                self.process(self._buffer)
-                self._signal.value = SIG_RUNNING
+        while True:
+            claimed = self._wait_for_data()
+            if claimed is None: break
+            slot, self.part = claimed
+            seq = self.sequence = self._seq[slot]
+            logger.info('New {:s}', self._data_name, every=1)
+            t = perf_counter()
+            result = self.process(self._get(slot,self.part))
+            done = self._release(slot,perf_counter()-t)
+            if not(self._reducing):
+                if done: self._finish(slot,seq,result if self._n_parts == 1 else None) # parts are not published
+                continue
+            if self._results is None: self._deliver(seq,self.part,result)
+            else: self._results.put((seq,self.part,result))
         logger.info('Process is stopped')
         self.finalize_process()
+        if self._results is None:
+            if self._reducing: self.finalize_reduce()
+        else: self._results.put(None)
+
+    def _run_reducer(self):
+        logger.attach(self._log_queue)
+        running = self.n_workers
+        while running:
+            rec = self._results.get()
+            if rec is None: running -= 1
+            else: self._deliver(*rec)
+        self.finalize_reduce()
 
 class imageProcess(dataProcess):
+    # process() receives a Fortran-ordered view of the volume in the shared buffer (no copy), which is valid only until process() returns.
+    # Set copy_image = True (or copy in process()) to keep volumes.
     _image_dimension = None
+    _data_name = 'image'
+    _images = None
+    copy_image = False
 
-    def __init__(self,image_dimension,autostart=True):
+    def __init__(self,image_dimension,autostart=True,n_slots=4,policy='drop_oldest',n_workers=1,slabs=1,result_shape=None):
+        # slabs > 1: process() receives slabs of the volume (along the 3rd dimension), possibly in different workers
         self._image_dimension = image_dimension
-        super().__init__(prod(self._image_dimension),autostart)
+        self._n_parts = slabs
+        self._slab_bounds = linspace(0,image_dimension[2],slabs+1).astype(int)
+        super().__init__(prod(self._image_dimension),autostart,n_slots,policy,n_workers,result_shape)
     
-    def _run(self):
-        while self._signal.value != SIG_STOPPED:
-            if self._signal.value == SIG_NOTSTARTED: 
-                logger.info('Process is running')
-                self._signal.value = SIG_RUNNING
-            if self._signal.value == SIG_NEWIMAGE:
-                img = array(self._buffer).reshape(flip(self._image_dimension,0)).transpose(2,1,0) 
-                logger.info('New image')
-                self.process(img)
-                self._signal.value = SIG_RUNNING
-        logger.info('Process is stopped')
\ No newline at end of file
+    def _get(self,slot,part=0):
+        if self._images is None: # views of the slots (and slabs), created once
+            self._images = [[img[:,:,self._slab_bounds[p]:self._slab_bounds[p+1]] for p in range(self._n_parts)] if self._n_parts > 1 else [img]
+                for img in [self.data[s].reshape(self._image_dimension,order='F') for s in range(self.n_slots)]]
+        img = self._images[slot][part]
+        if self.copy_image: return img.copy(order='F')
+        return img
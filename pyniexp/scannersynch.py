@@ -4,6 +4,7 @@ from time import time
 from multiprocessing import Process, Value, RawValue, RawArray
 
 import pyniexp.utils as utils
+from pyniexp.log import logger
 
 try:
     import nidaqmx
@@ -102,6 +103,7 @@ class scanner_synch:
 
         self._t0 = Value('d',time())      # internal timer
         self._keep_running = Value('b',-1) # internal signal (-1: not started, 1: running)
+        self._log_queue = logger.queue     # the process logs through the main process
 
     ## Destructor
     def __del__(self):
@@ -112,15 +114,15 @@ class scanner_synch:
     # Process
     def start_process(self,max_pulses=None):
         if self.__process.is_alive(): 
-            print('Process is already running')
+            logger.warning('Process is already running')
             return
 
         if max_pulses is None: max_pulses = self.__config['DAQ']['BufferLength']
 
-        print('Starting process...')
+        logger.info('Starting process...')
 
         if not(self.is_valid): 
-            print('You have to start the process manually by calling <object>.start_process()!')
+            logger.warning('You have to start the process manually by calling <object>.start_process()!')
             return
         self._synchpulsetimes = RawArray('d', [-1]*max_pulses)
         self._buttonstates = RawArray('b', [0]*self.number_of_buttons)
@@ -132,7 +134,7 @@ class scanner_synch:
         self.__process = Process(target=self._run)
         self.__process.start()
         while not(self.is_alive): pass
-        print('[{:.3f}s] - Process is running'.format(self.clock))
+        logger.info('[{:.3f}s] - Process is running', self.clock)
 
     @property
     def is_alive(self):
@@ -322,6 +324,8 @@ class scanner_synch:
 
     ## Low level methods
     def _run(self):
+        logger.attach(self._log_queue)
+
         # Start DAQ
         DAQ = []
         if self.__isDAQ:            
@@ -387,10 +391,10 @@ class scanner_synch:
 
             if self._keep_running.value == -1: self._keep_running.value = 1
 
-        print('Scanner Synch is closing...')
+        logger.info('Scanner Synch is closing...')
         if self.__isDAQ:
             [d.close() for d in DAQ]
         if self.emul_buttons: 
             Kb.stop()
-        print('Done')
-        print('Process rate (last iteration): {:.3f}s'.format(self.rate))
\ No newline at end of file
+        logger.info('Done')
+        logger.info('Process rate (last iteration): {:.3f}s', self.rate)
\ No newline at end of file
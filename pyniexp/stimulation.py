@@ -1,15 +1,342 @@
 import nidaqmx, serial, json, sys
-from numpy import concatenate, vstack, arange, linspace, cos, pi, ones
+from numpy import vstack, hstack, ascontiguousarray, arange, cos, pi, full, where, zeros, ones, load, memmap, ceil, asarray, shape, rint, floor, unique, interp, clip, diff, cumsum, concatenate, broadcast, broadcast_to, stack, repeat, minimum
+from numpy.random import default_rng
 from nidaqmx.stream_writers import AnalogMultiChannelWriter
 import matplotlib.pyplot as plt
-from loguru import logger
-from time import sleep
+from pyniexp.log import logger
+from time import sleep, perf_counter
+from collections import deque, OrderedDict
+from threading import Thread, Event, Lock, Condition
+from functools import wraps
 from pyniexp.utils import Status
 
-class Waveform:
-    SCALING = 2 # actual intensity (peak to trough) = amplitude * 2
+class Wave:
+    # Base of the composable waveforms: combine them with +, -, * (waves or numbers), then() and envelope()
+    # evaluate(t) maps time points [s] to samples, (n,) for a single channel or (channels x n): parameters given
+    # as lists (e.g. phase=[0, 90]) are broadcast across channels, so the whole expression is evaluated in one pass.
+    # duration and samplingRate of an expression are taken from its components, unless set explicitly.
+    SCALING = 2 # amplitude is the intensity peak to trough: samples = amplitude/SCALING * a shape spanning SCALING (e.g. cos)
+    duration = None # unlimited
+    samplingRate = None
+    dtype = 'float32'
+    CHANNELS = () # parameters broadcast across channels
 
-    def __init__(self,amplitude = 1, frequency = 10, phase=0, duration = 20, rampUp = 4, rampDown = 4, samplingRate = 1000):
+    @property
+    def nSamples(self):
+        return int(round(self.duration*self.samplingRate))
+
+    @property
+    def nChannels(self):
+        # from the parameters: evaluating may change the state (e.g. of LiveTone)
+        if not(len(self.CHANNELS)): return 1
+        s = broadcast(*[_channels(getattr(self,p)) for p in self.CHANNELS]).shape
+        return s[0] if len(s) > 1 else 1
+
+    @property
+    def time(self):
+        return arange(self.nSamples)/self.samplingRate
+
+    @property
+    def signal(self):
+        return self.chunk(0,self.nSamples)
+
+    def evaluate(self,t):
+        """Samples at time points t [s] to overwrite"""
+        raise NotImplementedError
+
+    def preview(self,width=1000,chunkSize=2**16):
+        # For plotting (e.g. width = plot width in pixels) without generating the whole signal:
+        # minimum and maximum of all samples in each of (at most) width bins, evaluated chunkSize samples at a time
+        # returns time points and samples, 2 per bin
+        n = self.nSamples
+        per = int(ceil(n/width)) # samples per bin
+        bins = int(ceil(n/per))
+        step = max(chunkSize//per,1)*per
+        data = []
+        for start in range(0,bins*per,step):
+            i = minimum(arange(start,min(start+step,bins*per)),n-1) # the last bin is padded with the last sample
+            d = asarray(self.evaluate(i/self.samplingRate))
+            d = d.reshape(d.shape[:-1]+(-1,per))
+            data.append(stack((d.min(axis=-1),d.max(axis=-1)),axis=-1))
+        data = concatenate(data,axis=-2)
+        return repeat(arange(bins)*per/self.samplingRate,2), data.reshape(data.shape[:-2]+(2*bins,))
+
+    def chunk(self,start,n):
+        # samples [start, start+n), zero after the end
+        assert not(self.duration is None or self.samplingRate is None), "duration and samplingRate MUST be set"
+        i = arange(start,start+n)
+        data = asarray(self.evaluate(i/self.samplingRate),dtype=self.dtype)
+        data[...,i >= self.nSamples] = 0
+        return data
+
+    def __add__(self,other): return Sum(self,other)
+    def __radd__(self,other): return Sum(other,self)
+    def __sub__(self,other): return Sum(self,Product(other,-1))
+    def __rsub__(self,other): return Sum(other,Product(self,-1))
+    def __mul__(self,other): return Product(self,other)
+    def __rmul__(self,other): return Product(other,self)
+    def __neg__(self): return Product(self,-1)
+
+    def then(self,other):
+        return Concat(self,other)
+
+    def envelope(self,points):
+        return Product(self,Envelope(points))
+
+    def show(self):
+        fig, ax = plt.subplots()
+        ax.plot(self.time , self.signal.T, label='Waveform')
+        ax.set(xlabel='time [s]', ylabel='intensity [mA]')
+        ax.grid()
+        ax.legend()
+
+        plt.show()
+
+def _channels(val):
+    # list -> column, to broadcast across channels
+    val = asarray(val,dtype='float64')
+    return val.reshape(-1,1) if val.ndim else val
+
+class Constant(Wave):
+    CHANNELS = ('value',)
+
+    def __init__(self,value=0,duration=None,samplingRate=None):
+        self.value = value
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    def evaluate(self,t):
+        return _channels(self.value)*ones(shape(t))
+
+class Tone(Wave):
+    CHANNELS = ('amplitude', 'frequency', 'phase')
+
+    def __init__(self,amplitude=1,frequency=10,phase=0,duration=None,samplingRate=None):
+        self.amplitude = amplitude # intensity, as in Waveform
+        self.frequency = frequency
+        self.phase = phase # degree
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    def evaluate(self,t):
+        return _channels(self.amplitude)/self.SCALING * cos(2*pi*_channels(self.frequency)*t - _channels(self.phase)*(pi/180))
+
+class LiveTone(Tone):
+    # Tone with targets set while it is output (see Stimulator.streamWaveform and Stimulator.update):
+    # a target is applied from the next evaluated chunk and approached linearly over transition [s].
+    # The phase is accumulated from the frequency, so changes have neither gap nor phase jump.
+    # Chunks MUST be evaluated in order, evaluating an earlier time restarts the accumulation.
+
+    def __init__(self,amplitude=1,frequency=10,phase=0,duration=None,samplingRate=None,transition=0.05):
+        super().__init__(amplitude,frequency,phase,duration,samplingRate)
+        self.transition = transition
+        self._target = None
+        self._ramp = None # start time, targets
+        self._last = None # time, cycles and frequency of the last evaluated sample
+
+    def setTarget(self,amplitude=None,frequency=None,phase=None):
+        target = {'amplitude': amplitude, 'frequency': frequency, 'phase': phase}
+        self._target = {k: v for k, v in target.items() if not(v is None)}
+
+    def evaluate(self,t):
+        t = asarray(t,dtype='float64')
+
+        # transitions
+        if not(self._ramp is None) and t[0] >= self._ramp[0] + self.transition:
+            for k, v in self._ramp[1].items(): setattr(self,k,v)
+            self._ramp = None
+        target, self._target = self._target, None
+        if not(target is None):
+            if not(self._ramp is None): target = dict(self._ramp[1], **target)
+            current = {k: self._parameter(k,t[0]) for k in target}
+            for k, v in current.items(): setattr(self,k,v)
+            self._ramp = (t[0], target)
+
+        amplitude = self._parameter('amplitude',t)
+        frequency = self._parameter('frequency',t)
+        phase = self._parameter('phase',t)
+        frequency = broadcast_to(frequency,broadcast(amplitude,frequency,phase,t).shape)
+
+        # phase accumulation (trapezoid, exact for the linear transitions)
+        if self._last is None or t[0] < self._last[0]: self._last = (t[0], 0, frequency[...,:1])
+        tLast, cycles, fLast = self._last
+        dt = diff(concatenate(([tLast],t)))
+        cycles = cycles + cumsum((concatenate((broadcast_to(fLast,frequency.shape[:-1]+(1,)),frequency[...,:-1]),axis=-1)+frequency)/2*dt,axis=-1)
+        self._last = (t[-1], cycles[...,-1:] % 1, frequency[...,-1:])
+
+        return amplitude/self.SCALING * cos(2*pi*cycles - phase*(pi/180))
+
+    def _parameter(self,name,t):
+        val = _channels(getattr(self,name))
+        if self._ramp is None or not(name in self._ramp[1]): return val
+        w = clip((t-self._ramp[0])/self.transition,0,1) if self.transition > 0 else 1
+        return val + (_channels(self._ramp[1][name])-val)*w
+
+class PulseTrain(Wave):
+    CHANNELS = ('amplitude', 'frequency', 'width', 'delay')
+
+    def __init__(self,amplitude=1,frequency=10,width=0.001,delay=0,duration=None,samplingRate=None):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.width = width # s
+        self.delay = delay # s, of the first pulse
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    def evaluate(self,t):
+        # monophasic: 0 between and SCALING during the pulses
+        t = t - _channels(self.delay)
+        return _channels(self.amplitude)/self.SCALING * self.SCALING*((t >= 0) & ((t % (1/_channels(self.frequency))) < _channels(self.width)))
+
+class Noise(Wave):
+    # Uniform white noise, sampled at rate and held, reproducible for any time point (and chunk) given the seed
+    BLOCK = 4096
+
+    def __init__(self,amplitude=1,rate=1000,seed=0,channels=None,duration=None,samplingRate=None):
+        nAmplitude = asarray(amplitude).size
+        if channels is None: channels = nAmplitude
+        assert nAmplitude in [1, channels], "Number of amplitudes ({}) is not equal with number of channels ({})".format(nAmplitude,channels)
+        self.amplitude = amplitude
+        self.rate = rate
+        self.seed = seed
+        self.channels = channels # independent noise per channel (default: one per amplitude)
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    @property
+    def nChannels(self):
+        return self.channels
+
+    def evaluate(self,t):
+        k = floor(asarray(t)*self.rate).astype('int64')
+        data = zeros((self.channels,)+k.shape)
+        for b in unique(k // self.BLOCK):
+            sel = (k // self.BLOCK) == b
+            for c in range(self.channels):
+                data[c,sel] = default_rng([self.seed, c, int(b)]).uniform(-1,1,self.BLOCK)[k[sel] % self.BLOCK]
+        data = _channels(self.amplitude)/self.SCALING * data
+        return data if self.channels > 1 else data[0]
+
+class Envelope(Wave):
+    # Piecewise linear: [(time, value), ...], e.g. Envelope([(0,0), (4,1), (16,1), (20,0)])
+
+    def __init__(self,points,samplingRate=None):
+        self.points = points
+        self.duration = points[-1][0]
+        self.samplingRate = samplingRate
+
+    def evaluate(self,t):
+        return interp(t,[p[0] for p in self.points],[p[1] for p in self.points])
+
+class Function(Wave):
+
+    def __init__(self,function,duration=None,samplingRate=None):
+        self.function = function # vectorised, time points [s] -> samples
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    @property
+    def nChannels(self):
+        s = shape(self.function(zeros(1)))
+        return s[0] if len(s) > 1 else 1
+
+    def evaluate(self,t):
+        return self.function(t)
+
+class _Composite(Wave):
+
+    @property
+    def duration(self):
+        if not(self._duration is None): return self._duration
+        d = [w.duration for w in self.waves if not(w.duration is None)]
+        return self._combine(d) if len(d) else None
+
+    @duration.setter
+    def duration(self,val):
+        self._duration = val
+
+    @property
+    def samplingRate(self):
+        if not(self._samplingRate is None): return self._samplingRate
+        r = [w.samplingRate for w in self.waves if not(w.samplingRate is None)]
+        return max(r) if len(r) else None
+
+    @samplingRate.setter
+    def samplingRate(self,val):
+        self._samplingRate = val
+
+    def __init__(self,*waves,duration=None,samplingRate=None):
+        self.waves = [w if isinstance(w,Wave) else Constant(w) for w in waves]
+        self.duration = duration
+        self.samplingRate = samplingRate
+
+    @property
+    def nChannels(self):
+        return max([w.nChannels for w in self.waves])
+
+    def find(self,cls):
+        # components of type cls
+        found = []
+        for w in self.waves:
+            if isinstance(w,cls): found.append(w)
+            if isinstance(w,_Composite): found += w.find(cls)
+        return found
+
+    def _evaluate(self,w,t):
+        # zero outside its own duration
+        if w.duration is None: return w.evaluate(t)
+        return where(t < w.duration, w.evaluate(t), 0)
+
+class Sum(_Composite):
+    _combine = staticmethod(max)
+
+    def evaluate(self,t):
+        data = self._evaluate(self.waves[0],t)
+        for w in self.waves[1:]: data = data + self._evaluate(w,t)
+        return data
+
+class Product(_Composite):
+    _combine = staticmethod(min)
+
+    def evaluate(self,t):
+        data = self._evaluate(self.waves[0],t)
+        for w in self.waves[1:]: data = data * self._evaluate(w,t)
+        return data
+
+class Concat(_Composite):
+    # one after the other, each of them MUST have a duration
+
+    @staticmethod
+    def _combine(d): return sum(d)
+
+    def evaluate(self,t):
+        t = asarray(t)
+        nChannels = self.nChannels
+        data = zeros((nChannels,)+t.shape if nChannels > 1 else t.shape)
+        offset = 0
+        for w in self.waves:
+            sel = (t >= offset) & (t < offset+w.duration)
+            if sel.any(): data[...,sel] = w.evaluate(t[sel]-offset)
+            offset += w.duration
+        return data
+
+class Stack(_Composite):
+    # channels from single-channel waves
+    _combine = staticmethod(max)
+
+    @property
+    def nChannels(self):
+        return len(self.waves)
+
+    def evaluate(self,t):
+        data = zeros((len(self.waves),)+shape(t))
+        for c in range(len(self.waves)): data[c] = self._evaluate(self.waves[c],t)
+        return data
+
+class Waveform(Wave):
+    PARAMETERS = ['amplitude', 'frequency', 'phase', 'duration', 'rampUp', 'rampDown', 'samplingRate', 'dtype'] # changing any of them invalidates the signal
+
+    def __init__(self,amplitude = 1, frequency = 10, phase=0, duration = 20, rampUp = 4, rampDown = 4, samplingRate = 1000, dtype = 'float64'):
         
         self.amplitude = amplitude/self.SCALING 
         self.frequency = frequency
@@ -18,7 +345,12 @@ class Waveform:
         self.rampDown = rampDown
         self.duration = duration
         self.samplingRate = samplingRate
+        self.dtype = dtype # 'float32' halves the memory
     
+    def __setattr__(self,name,val):
+        if name in self.PARAMETERS: self.__dict__['_signal'] = None
+        super().__setattr__(name,val)
+
     @property
     def duration(self): return self._duration
 
@@ -28,33 +360,129 @@ class Waveform:
         self._duration = val
 
     @property
-    def signal(self):
-        stimDuration = self.duration-(self.rampUp+self.rampDown)
-        dt = 1/self.samplingRate    # seconds per sample
-        
-        t = arange(0,self.duration,dt)   # timesteps
-        lag = self.phase*(pi/180)        # calculate into phase
+    def time(self):
+        return _timeAxis(self.nSamples,self.samplingRate,self.dtype)
 
-        waveform = cos(2*pi*self.frequency*t-lag)
+    @property
+    def signal(self):
+        # read-only, shared with other Waveforms of the same parameters: use signal.copy() to modify it
+        if self._signal is None:
+            self._signal = _generateSignal(self.amplitude,self.frequency,self.phase,self.duration,self.rampUp,self.rampDown,self.samplingRate,self.dtype)
+        return self._signal
+
+    def evaluate(self,t):
+        return _evaluate(rint(asarray(t)*self.samplingRate),self.amplitude,self.frequency,self.phase,self.nSamples,
+            int(round(self.rampUp*self.samplingRate)),int(round(self.rampDown*self.samplingRate)),self.samplingRate)
+
+# Signals (and time axes) are cached by parameters, so repeated conditions are not regenerated.
+# The least recently used ones are released above CACHE_BYTES in total; larger arrays are not cached.
+CACHE_BYTES = 256*2**20
+_cache = OrderedDict()
+_cacheLock = Lock()
+
+def _cached(function):
+    @wraps(function)
+    def cached(*args):
+        key = (function.__name__,) + args
+        with _cacheLock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+        val = function(*args)
+        with _cacheLock:
+            if val.nbytes <= CACHE_BYTES and not(key in _cache):
+                _cache[key] = val
+                while sum([v.nbytes for v in _cache.values()]) > CACHE_BYTES: _cache.popitem(last=False)
+        return val
+    return cached
+
+@_cached
+def _timeAxis(nSamples,samplingRate,dtype):
+    t = (arange(nSamples)/samplingRate).astype(dtype)
+    t.flags.writeable = False
+    return t
+
+@_cached
+def _generateSignal(amplitude,frequency,phase,duration,rampUp,rampDown,samplingRate,dtype):
+    nSamples = int(round(duration*samplingRate))
+    signal = _evaluate(arange(nSamples),amplitude,frequency,phase,nSamples,
+        int(round(rampUp*samplingRate)),int(round(rampDown*samplingRate)),samplingRate).astype(dtype)
+    signal.flags.writeable = False
+    return signal
+
+def _evaluate(i,amplitude,frequency,phase,nSamples,nUp,nDown,samplingRate):
+    # sample indices -> samples
+    lag = phase*(pi/180)        # calculate into phase
+    waveform = cos(2*pi*frequency*(i/samplingRate)-lag)
+
+    # linear ramps (as linspace(0,amplitude,nUp) and linspace(amplitude,0,nDown)) and zero after the end
+    envelope = full(i.shape,float(amplitude))
+    if nUp: envelope = where(i < nUp, amplitude*i/max(nUp-1,1), envelope)
+    if nDown: envelope = where(i >= nSamples-nDown, amplitude*(1-(i-nSamples+nDown)/max(nDown-1,1)), envelope)
+    envelope[i >= nSamples] = 0
+
+    return envelope * waveform
+
+class SampledWave(Wave):
+    # Waveform given by its samples, (n,) or (channels x n)
+
+    def __init__(self,data,samplingRate=1000):
+        self._data = data
+        self.samplingRate = samplingRate
 
-        rampup = linspace(0,self.amplitude,self.rampUp*self.samplingRate)
-        rampdown = linspace(self.amplitude,0,self.rampDown*self.samplingRate)
-        envelope = concatenate((rampup,self.amplitude*ones(int(stimDuration*self.samplingRate)),rampdown))
+    @property
+    def nSamples(self):
+        return self._data.shape[-1]
 
-        return envelope * waveform
+    @property
+    def duration(self):
+        return self.nSamples/self.samplingRate
 
-    def show(self):
-        fig, ax = plt.subplots()
-        ax.plot(arange(0,self.duration,1/self.samplingRate) , self.signal, label='Waveform')
-        ax.set(xlabel='time [s]', ylabel='intensity [mA]')
-        ax.grid()
-        ax.legend()
+    @property
+    def nChannels(self):
+        return self._data.shape[0] if self._data.ndim > 1 else 1
 
-        plt.show()
+    @property
+    def signal(self):
+        return self._data
+
+    def evaluate(self,t):
+        k = rint(asarray(t)*self.samplingRate).astype('int64')
+        data = zeros(self._data.shape[:-1]+k.shape)
+        sel = (k >= 0) & (k < self.nSamples)
+        data[...,sel] = self._data[...,k[sel]]
+        return data
+
+    def chunk(self,start,n):
+        data = zeros(self._data.shape[:-1]+(n,))
+        if start < self.nSamples:
+            chunk = self._data[...,start:start+n]
+            data[...,:chunk.shape[-1]] = chunk
+        return data
+
+class WaveformFile(SampledWave):
+    # Precomputed waveform (e.g. from another software) read through a memory map
+    # .npy files are opened with numpy.load, any other file is read as raw samples of dtype
+    # Multichannel files are (samples x channels); channel selects the column
+
+    def __init__(self,fileName,samplingRate=1000,dtype='float64',channel=0,nChannels=1):
+        if fileName.endswith('.npy'): data = load(fileName,mmap_mode='r')
+        else: data = memmap(fileName,dtype=dtype,mode='r')
+        if data.ndim == 1: data = data.reshape(-1,nChannels)
+        super().__init__(data[:,channel],samplingRate)
 
 class Stimulator:
     isDAQ = False
     _DAQ = None
+    _feeder = None
+    _bank = {}
+    _bankTask = None
+    _trigger = None
+    _divider = None
+    _updateRequested = None
+    onDone = None # called (from a driver thread) when the output is done
+    onProgress = None # called (from a driver thread) with the number of samples written to the device, every progressInterval
+    progressInterval = 0.1 # s
 
     @property
     def nChannels(self):
@@ -75,6 +503,9 @@ class Stimulator:
         except:
             print('WARNING - DAQ card {} is not available'.format(self.__config['DAQ']['Hardware']), sys.exc_info()[0])
 
+        self.done = Event() # set when the output is done (or not started), no need to poll the device
+        self.done.set()
+        self.samplesOutput = 0
         if self.isDAQ:
             self.initialize()
             self.waves = []
@@ -83,9 +514,12 @@ class Stimulator:
     def __del__(self):
         if self.isDAQ: 
             self.close()
+        if not(self._divider is None): self._divider.close()
 
     def initialize(self):
+        self._stopFeeder()
         if not(self._DAQ is None): self.close()
+        self.done.set()
         self._DAQ = nidaqmx.Task()
 
         for ch in self.__config['Channels']:
@@ -96,52 +530,261 @@ class Stimulator:
         if not(self.__config['ControlSignal'] is None):
             self._DAQ.write([self.__config['ControlSignal']]*self.nChannels)
 
+        if not(self._trigger is None): self._configureTrigger()
+
     def close(self):
         if self._DAQ is None: return
         self._DAQ.close()
         self._DAQ = None
 
+    def armTrigger(self,source=None,edge='RISING',retriggerable=False,everyN=1,scannerConfig=None):
+        # Output starts on a digital edge (e.g. scanner pulse) after stimulate(), which only arms the task
+        # source: terminal (e.g. 'PFI0' or '/Dev1/PFI0'), default: ['SynchPulse']['Trigger'] in scannerConfig (file) if given,
+        #   otherwise ['Trigger']['Source'] in the stimulation config
+        # retriggerable (finite output only): every trigger replays the buffer
+        # everyN > 1: only every Nth pulse, divided by a counter (['Trigger']['Counter'] in the stimulation config, default 'ctr0')
+        if self._DAQ is None:
+            logger.error('DAQ card {} is not available', self.__config['DAQ']['Hardware'])
+            return
+        hardware = self.__config['DAQ']['Hardware']
+        if source is None and not(scannerConfig is None):
+            with open(scannerConfig) as config: config = json.load(config)
+            source = config['SynchPulse']['Trigger']
+            hardware = config['DAQ']['Hardware']
+        elif source is None: source = self.__config['Trigger']['Source']
+        if not(source.startswith('/')): source = '/' + hardware + '/' + source
+
+        self._trigger = {'Source': source, 'Edge': nidaqmx.constants.Edge[edge], 'Retriggerable': retriggerable}
+        if not(self._divider is None): self._divider.close(); self._divider = None
+        if everyN > 1:
+            counter = self.__config.get('Trigger',{}).get('Counter','ctr0')
+            self._divider = nidaqmx.Task()
+            self._divider.co_channels.add_co_pulse_chan_ticks(self.__config['DAQ']['Hardware'] + '/' + counter, source_terminal=source,
+                low_ticks=everyN-everyN//2, high_ticks=everyN//2) # one rising edge per N pulses
+            self._divider.timing.cfg_implicit_timing(sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS)
+            self._trigger.update({'Source': '/' + self.__config['DAQ']['Hardware'] + '/' + counter.capitalize() + 'InternalOutput', 'Edge': nidaqmx.constants.Edge.RISING})
+        self._configureTrigger()
+        logger.info('Output is triggered by {} (retriggerable = {}, every {:d} pulse(s))', source, retriggerable, everyN)
+
+    def disarmTrigger(self):
+        self._trigger = None
+        if not(self._divider is None): self._divider.close(); self._divider = None
+        if not(self._DAQ is None):
+            self._DAQ.triggers.start_trigger.disable_start_trig()
+            self._DAQ.triggers.start_trigger.retriggerable = False
+
+    @property
+    def triggerTime(self):
+        # time of the last trigger recorded by the device (s, as time.time()), None if not available (device or driver)
+        try: return self._DAQ.triggers.start_trigger.timestamp_val.timestamp()
+        except (AttributeError, nidaqmx.DaqError) as e:
+            logger.warning('Trigger time is not available: {}', e, every=10)
+            return None
+
     @property
     def status(self):
         if self._DAQ is None: return Status.DISCONNECTED
         elif len(self.waves) == 0: return Status.CONNECTED
-        elif self._DAQ.is_task_done(): return Status.STOPPED
+        elif self.done.is_set(): return Status.STOPPED
         else: return Status.RUNNING
 
+    def waitUntilDone(self,timeout=None):
+        # returns whether the output is done
+        return self.done.wait(timeout)
+
     def loadWaveform(self,waveList=None,waitUntilFinished=False):
-        if waveList is None: 
-            waveList = self.waves
-        else:
-            assert (type(waveList) == list) & (type(waveList[0]) == Waveform), "Input MUST be a list of Waveforms"
-            assert len(waveList) == self.nChannels, "Number of waves ({}) is not equal with number of channels ({})".format(len(waveList),self.nChannels)
-            assert all([d == waveList[0].duration for d in [w.duration for w in waveList]]) & \
-                all([d == waveList[0].samplingRate for d in [w.samplingRate for w in waveList]]), "Waves MUST have the same duration and sampling rate"
-            self.waves = waveList
+        self._setWaves(waveList)
 
-        if (self.status == Status.RUNNING and waitUntilFinished): self._DAQ.wait_until_done()
+        if (self.status == Status.RUNNING and waitUntilFinished): self.waitUntilDone()
         self.initialize()
 
         self._DAQ.timing.cfg_samp_clk_timing(
             rate = self.waves[0].samplingRate,
             sample_mode = nidaqmx.constants.AcquisitionType.FINITE,
             samps_per_chan = int(self.waves[0].duration * self.waves[0].samplingRate))
+        self._registerEvents(self.waves[0].samplingRate)
         writer = AnalogMultiChannelWriter(self._DAQ.out_stream,auto_start=False)  
-        writer.write_many_sample(vstack([w.signal for w in self.waves]))
+        writer.write_many_sample(vstack([w.signal for w in self.waves]).astype('float64',copy=False))
+
+    def streamWaveform(self,waveList=None,waitUntilFinished=False,leadTime=1,chunkDuration=0.1):
+        # Continuous, non-regenerating output for arbitrarily long waves in constant memory:
+        # chunks are generated (or read from WaveformFile) on the fly and written up to leadTime [s] ahead of the output
+        self._setWaves(waveList)
+
+        if (self.status == Status.RUNNING and waitUntilFinished): self.waitUntilDone()
+        self.initialize()
+
+        samplingRate = self.waves[0].samplingRate
+        nChunk = max(int(round(chunkDuration*samplingRate)),1)
+        nBuffer = max(int(ceil(leadTime/chunkDuration)),2)*nChunk
+        self._DAQ.timing.cfg_samp_clk_timing(
+            rate = samplingRate,
+            sample_mode = nidaqmx.constants.AcquisitionType.CONTINUOUS,
+            samps_per_chan = nBuffer)
+        self._DAQ.out_stream.regen_mode = nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        self._DAQ.out_stream.output_buf_size = nBuffer
+        self._registerEvents(samplingRate)
+        writer = AnalogMultiChannelWriter(self._DAQ.out_stream,auto_start=False)
+
+        buffer = zeros((self.nChannels,nChunk))
+        self._updateLock = Lock()
+        self.updateLatency = [] # s, from update() to the output of its first sample
+        self._written = 0
+        while self._written < nBuffer: self._writeChunk(writer,buffer) # prefill
+        self._stopStreaming = Event()
+        self._feeder = Thread(target=self._feed,args=(writer,buffer),daemon=True)
+        self._streamConfig = (leadTime, chunkDuration)
     
+    def prepareBank(self,bank):
+        # {condition: Wave or list of Waves}, generated once
+        # switchTo(condition) and sequence([conditions]) reuse the task and only rewrite its buffer
+        self._bank = {}
+        for name, waveList in bank.items():
+            self._setWaves(waveList)
+            self._bank[name] = (self.waves, ascontiguousarray(vstack([w.signal for w in self.waves]),dtype='float64'))
+        assert len(set([waves[0].samplingRate for waves, data in self._bank.values()])) == 1, "Waves MUST have the same sampling rate"
+        self.waves = [] # nothing to output until switchTo or sequence
+        self._bankTask = None
+        self.switchLatency = [] # s, per switch
+        self._prepareBankTask()
+
+    def switchTo(self,condition,waitUntilFinished=False):
+        self._loadBuffer(self._bank[condition][0],self._bank[condition][1],waitUntilFinished)
+        logger.info('Switched to {} in {:.3f} ms', condition, self.switchLatency[-1]*1000)
+
+    def sequence(self,conditions,waitUntilFinished=False):
+        # back-to-back in one buffer, without gaps
+        self._loadBuffer(self._bank[conditions[0]][0],hstack([self._bank[c][1] for c in conditions]),waitUntilFinished)
+        logger.info('Switched to sequence {} in {:.3f} ms', conditions, self.switchLatency[-1]*1000)
+
+    def update(self,**targets):
+        # amplitude, frequency and/or phase for the LiveTones in the waves
+        # while streaming, they are output from the next chunk, i.e. after at most leadTime + chunkDuration
+        live = [w for w in self.waves if isinstance(w,LiveTone)]
+        for w in [w for w in self.waves if isinstance(w,_Composite)]: live += w.find(LiveTone)
+        assert len(live), "Waves MUST contain LiveTone"
+        if self._feeder is None:
+            for w in live: w.setTarget(**targets)
+            return
+        with self._updateLock:
+            for w in live: w.setTarget(**targets)
+            self._updateRequested = perf_counter()
+
     def stimulate(self):
-        if self.status == Status.CONFIGURED: self._DAQ.start()
+        if self.status == Status.CONNECTED: logger.error('No waveform is loaded (or selected with switchTo)')
+        if self.status == Status.CONFIGURED: 
+            if not(self._divider is None) and self._divider.is_task_done(): self._divider.start() # counting pulses before the output is armed
+            if not(self._feeder is None) and not(self._feeder.ident is None): # streamed before: the stream is set up again
+                self.streamWaveform(self.waves,False,*self._streamConfig)
+            self.samplesOutput = 0
+            self.done.clear()
+            self._DAQ.start()
+            if not(self._feeder is None): self._feeder.start()
 
     def stop(self):
         self.initialize()
 
+    def _setWaves(self,waveList):
+        if waveList is None: return
+        if isinstance(waveList,Wave): waveList = [waveList] # multichannel expression
+        assert (type(waveList) == list) & all([isinstance(w,Wave) for w in waveList]), "Input MUST be a Wave or a list of Waves"
+        nChannels = sum([w.nChannels for w in waveList])
+        assert nChannels == self.nChannels, "Number of waves ({}) is not equal with number of channels ({})".format(nChannels,self.nChannels)
+        assert all([d == waveList[0].duration for d in [w.duration for w in waveList]]) & \
+            all([d == waveList[0].samplingRate for d in [w.samplingRate for w in waveList]]), "Waves MUST have the same duration and sampling rate"
+        self.waves = waveList
+
+    def _prepareBankTask(self):
+        # once, and again only if the task has been recreated (e.g. by stop or loadWaveform)
+        if self._bankTask is self._DAQ: return
+        if self._DAQ is None or not(self._feeder is None): self.initialize() # streaming task is not reused
+        self._DAQ.timing.cfg_samp_clk_timing(
+            rate = list(self._bank.values())[0][0][0].samplingRate,
+            sample_mode = nidaqmx.constants.AcquisitionType.FINITE,
+            samps_per_chan = max([data.shape[1] for waves, data in self._bank.values()]))
+        self._registerEvents(list(self._bank.values())[0][0][0].samplingRate)
+        self._bankWriter = AnalogMultiChannelWriter(self._DAQ.out_stream,auto_start=False)
+        self._bankTask = self._DAQ
+
+    def _loadBuffer(self,waves,data,waitUntilFinished):
+        if (self.status == Status.RUNNING and waitUntilFinished): self.waitUntilDone()
+        t0 = perf_counter()
+        if self._bankTask is self._DAQ: self._DAQ.stop(); self.done.set()
+        else: self._prepareBankTask()
+        self._DAQ.timing.samp_quant_samp_per_chan = data.shape[1]
+        self._bankWriter.write_many_sample(data)
+        self.waves = waves
+        self.switchLatency.append(perf_counter()-t0)
+
+    def _configureTrigger(self):
+        self._DAQ.triggers.start_trigger.cfg_dig_edge_start_trig(self._trigger['Source'],trigger_edge=self._trigger['Edge'])
+        self._DAQ.triggers.start_trigger.retriggerable = self._trigger['Retriggerable']
+        try: self._DAQ.triggers.start_trigger.timestamp_enable = True
+        except (AttributeError, nidaqmx.DaqError): pass
+
+    def _registerEvents(self,samplingRate):
+        # once per task, before it is started
+        n = max(int(round(self.progressInterval*samplingRate)),1)
+        self._DAQ.register_done_event(self._done)
+        self._DAQ.register_every_n_samples_transferred_from_buffer_event(n,self._progress)
+
+    def _done(self,task_handle,status,callback_data):
+        if self.done.is_set(): return 0
+        if status != 0: logger.error('Output stopped with error {:d}', status)
+        self.done.set()
+        if not(self.onDone is None): self.onDone()
+        return 0
+
+    def _progress(self,task_handle,every_n_samples_event_type,number_of_samples,callback_data):
+        self.samplesOutput += number_of_samples
+        if not(self.onProgress is None): self.onProgress(self.samplesOutput)
+        return 0
+
+    def _writeChunk(self,writer,buffer):
+        with self._updateLock:
+            requested, self._updateRequested = self._updateRequested, None
+            buffer[:] = vstack([w.chunk(self._written,buffer.shape[1]) for w in self.waves])
+        if not(requested is None): ahead = self._written - self._DAQ.out_stream.total_samp_per_chan_generated
+        writer.write_many_sample(buffer)
+        if not(requested is None): self.updateLatency.append(perf_counter() - requested + ahead/self.waves[0].samplingRate)
+        self._written += buffer.shape[1]
+
+    def _feed(self,writer,buffer):
+        out = self._DAQ.out_stream
+        nSamples = self.waves[0].nSamples
+        wait = buffer.shape[1]/self.waves[0].samplingRate/4
+        try:
+            while not(self._stopStreaming.is_set()):
+                if out.total_samp_per_chan_generated >= nSamples: # the end of the waves is out, the rest is zero padding
+                    self._DAQ.stop() # no done event for stopping
+                    break
+                if out.space_avail < buffer.shape[1]: self._stopStreaming.wait(wait)
+                else: self._writeChunk(writer,buffer)
+        except Exception: # driver (e.g. underflow) or waves
+            if not(self._stopStreaming.is_set()):
+                logger.exception('Streaming failed after {:d} samples', self._written)
+                try: self._DAQ.stop()
+                except nidaqmx.DaqError: pass
+        finally:
+            if not(self._stopStreaming.is_set()): self._done(None,0,None) # otherwise stopped by initialize
+
+    def _stopFeeder(self):
+        if self._feeder is None: return
+        self._stopStreaming.set()
+        if self._feeder.is_alive(): self._feeder.join()
+        self._feeder = None
+
 class TI:
 
     __config = None
     _serial = None
     status = Status.DISCONNECTED
-    wait = 1 #s, wait after commands
+    wait = 1 #s, wait after commands (if the device does not acknowledge)
+    timeout = 1 #s, for the acknowledgement of a command (+ ramp duration for RampWfm)
+    minInterval = 0.1 #s, between amplitude updates (setAmplitude)
     verbose = True
     emulate = False
+    _writer = None
 
     @property
     def amplitude(self):
@@ -157,31 +800,52 @@ class TI:
             self.__config = json.load(config)
         self.port = self.__config['Port']
         self.channels = self.__config['Channels']
+        # Commands are acknowledged by a response line starting with 'Acknowledgement' (e.g. "OK"), if it is configured,
+        # so that each command returns as soon as the device is done and independent commands can be pipelined.
+        # Otherwise, the device is given 'wait' seconds after each command.
+        self.acknowledgement = self.__config.get('Acknowledgement',None)
+        if 'Timeout' in self.__config: self.timeout = self.__config['Timeout']
+        self._pending = deque() # commands waiting for response, in order
+        self._lock = Lock()
+
+        # Amplitude updates (setAmplitude)
+        if 'MinInterval' in self.__config: self.minInterval = self.__config['MinInterval']
+        self._output = [0, 0] # mA, after the last ramp sent
+        self._target = None
+        self._targetReady = Condition()
+        self.coalesced = 0 # updates replaced by a newer one before being sent
+        self.commandLog = deque(maxlen=10000) # amplitude updates written
 
     def __del__(self):
+        self.stopWriter()
         self.stop()
         self.unload()
         self._serial.close()
         logger.info('TI stimulator is disconnected')
 
     def connect(self):
-        self._serial = serial.Serial(port=self.port,baudrate=self.__config['BaudRate'])
+        self._serial = serial.Serial(port=self.port,baudrate=self.__config['BaudRate'],timeout=0.1)
 
         if self._serial.isOpen():
-            logger.info('TI stimulator is connected (port = {}, BaudRate = {:d})'.format(self.__config['Port'],self.__config['BaudRate']))
+            logger.info('TI stimulator is connected (port = {}, BaudRate = {:d})'.format(self.port,self.__config['BaudRate']))
             self.status = Status.CONNECTED
+            if not(self.acknowledgement is None): Thread(target=self._read,daemon=True).start()
         else:
             logger.error('Conneciton failed on {}, check port!'.format(self.__config['Port']))
             self.status = Status.DISCONNECTED
 
     def load(self):
         logger.info('Uploading device parameters')
-        self.sendCommand('DDS 0 {}'.format(self.channels[0]['Freqency']))
-        self.sendCommand('DDS 1 {}'.format(self.channels[1]['Freqency']))
-        self.sendCommand('ChConfig {:d} {:d} {:d} {:d} {:02d} {:02d} {:02d} {:02d}'.format(
-            self.channels[0]['loadA'],self.channels[0]['loadB'],self.channels[1]['loadA'],self.channels[1]['loadB'],
-            self.channels[0]['pinA'],self.channels[0]['pinB'],self.channels[1]['pinA'],self.channels[1]['pinB']
-            ))
+        pipelined = not(self.acknowledgement is None) # independent commands
+        requests = [
+            self.sendCommand('DDS 0 {}'.format(self.channels[0]['Freqency']),nowait=pipelined),
+            self.sendCommand('DDS 1 {}'.format(self.channels[1]['Freqency']),nowait=pipelined),
+            self.sendCommand('ChConfig {:d} {:d} {:d} {:d} {:02d} {:02d} {:02d} {:02d}'.format(
+                self.channels[0]['loadA'],self.channels[0]['loadB'],self.channels[1]['loadA'],self.channels[1]['loadB'],
+                self.channels[0]['pinA'],self.channels[0]['pinB'],self.channels[1]['pinA'],self.channels[1]['pinB']
+                ),nowait=pipelined)
+            ]
+        if not(self.waitForDevice(requests)): return
         self.status = Status.CONFIGURED
 
     def unload(self):
@@ -190,26 +854,128 @@ class TI:
             return
         
         logger.info('Unloading device')
-        self.sendCommand('ChConfig 00 00 00 00 08 09 10 11')
-        self.status = Status.UNCONFIGURED
+        if self.sendCommand('ChConfig 00 00 00 00 08 09 10 11'):
+            self.status = Status.UNCONFIGURED
 
     def start(self,nowait=False,verbose=None):
         if self.amplitude == [0,0]:
             self.amplitude = [ch['Amplitutde'] for ch in self.__config['Channels']]
         logger.info('Stimulation started...')
-        self.sendCommand('RampWfm mA 0 {} 0 {} {}'.format(*self.amplitude,self.__config['rampUp']),nowait=nowait,verbose=verbose)
-        self.status = Status.RUNNING
+        if self.sendCommand('RampWfm mA 0 {} 0 {} {}'.format(*self.amplitude,self.__config['rampUp']),nowait=nowait,verbose=verbose):
+            self._output = self.amplitude
+            self.status = Status.RUNNING
 
     def stop(self,nowait=False,verbose=None):
         if self.status != Status.RUNNING: 
             logger.warning('Stimulation is not running')
             return
         logger.info('Stimulation stopped')
-        self.sendCommand('RampWfm mA {} 0 {} 0 {}'.format(*self.amplitude,self.__config['rampDown']),nowait=nowait,verbose=verbose)
-        self.status = Status.STOPPED
-
-    def sendCommand(self,cmd,nowait=False,verbose=None):
+        self.stopWriter()
+        if self.sendCommand('RampWfm mA {} 0 {} 0 {}'.format(*self._output,self.__config['rampDown']),nowait=nowait,verbose=verbose):
+            self._output = [0, 0]
+            self.status = Status.STOPPED
+
+    def setAmplitude(self,amplitude,ramp=None):
+        # Non-blocking update during stimulation, e.g. every TR in closed loop: a background writer ramps to the newest target
+        # in ramp ms (default: 'rampUpdate' in the config or 100), pending targets are replaced, and the commands are
+        # sent no more often than minInterval and not before the previous one is acknowledged
+        if self.status != Status.RUNNING:
+            logger.error('Stimulation is not running, amplitude is not set')
+            return
+        if ramp is None: ramp = self.__config.get('rampUpdate',100)
+        with self._targetReady:
+            if not(self._target is None): self.coalesced += 1
+            self._target = (list(amplitude), ramp, perf_counter())
+            self._targetReady.notify()
+        if self._writer is None:
+            self._writing = True
+            self._writer = Thread(target=self._write,daemon=True)
+            self._writer.start()
+
+    def stopWriter(self):
+        # after sending the pending target
+        if self._writer is None: return
+        with self._targetReady:
+            self._writing = False
+            self._targetReady.notify()
+        self._writer.join()
+        self._writer = None
+
+    def sendCommand(self,cmd,nowait=False,verbose=None,timeout=None):
+        # returns whether the command is acknowledged (True if the device does not acknowledge)
+        # nowait: returns without waiting, the request to pass to waitForDevice if the device acknowledges
         if verbose is None: verbose = self.verbose
         if verbose: logger.info(cmd)
-        if not(self.emulate): self._serial.write((cmd+'\r').encode())
-        if not(nowait): sleep(self.wait)
\ No newline at end of file
+        if self.emulate: return True
+        if self.acknowledgement is None:
+            self._serial.write((cmd+'\r').encode())
+            if not(nowait): sleep(self.wait)
+            return True
+
+        if timeout is None:
+            timeout = self.timeout
+            if cmd.startswith('RampWfm'): timeout += float(cmd.split()[-1])/1000
+        request = {'Command': cmd, 'Done': Event(), 'Response': None, 'Deadline': perf_counter() + timeout, 'TimedOut': False}
+        with self._lock:
+            # commands not answered within another timeout are dropped, not to hold up the matching
+            while len(self._pending) and self._pending[0]['Deadline'] + self.timeout < perf_counter():
+                dropped = self._pending.popleft()
+                dropped['TimedOut'] = True
+                logger.warning('Response to "{}" is not expected any more', dropped['Command'])
+            self._pending.append(request)
+            self._serial.write((cmd+'\r').encode())
+        if nowait: return request
+        return self.waitForDevice(request)
+
+    def waitForDevice(self,requests=None):
+        # for requests (or results) of sendCommand, or all pending commands if None, returns whether they are acknowledged
+        if self.acknowledgement is None: return True
+        if requests is None: requests = list(self._pending)
+        elif not(isinstance(requests,list)): requests = [requests]
+        ok = True
+        for r in requests:
+            if isinstance(r,bool): ok = ok and r # already waited for (or not acknowledged)
+            elif not(r['Done'].wait(max(r['Deadline'] - perf_counter(),0))):
+                logger.error('No response to "{}"', r['Command'])
+                r['TimedOut'] = True
+                ok = False
+            elif not(r['Response'].startswith(self.acknowledgement)):
+                logger.error('"{}" failed: {}', r['Command'], r['Response'])
+                ok = False
+        return ok
+
+    def _write(self):
+        last = 0
+        while True:
+            with self._targetReady:
+                while self._target is None and self._writing: self._targetReady.wait()
+                if self._target is None: break
+            sleep(max(last + self.minInterval - perf_counter(),0)) # newer targets may arrive meanwhile
+            with self._targetReady:
+                (amplitude, ramp, requested), self._target = self._target, None
+
+            cmd = 'RampWfm mA {} {} {} {} {}'.format(self._output[0],amplitude[0],self._output[1],amplitude[1],ramp)
+            last = perf_counter()
+            ok = self.sendCommand(cmd,verbose=False)
+            if ok: self._output = amplitude
+            self.commandLog.append({'Time': last, 'Requested': requested, 'Command': cmd, 'Acknowledged': ok}) # perf_counter
+
+    def _read(self):
+        # responses are matched to the commands in order (late responses included)
+        # reads time out (0.1 s) in the middle of lines, which are buffered until '\r\n'
+        buffer = b''
+        while self._serial.isOpen():
+            try: buffer += self._serial.read(self._serial.in_waiting or 1)
+            except (serial.SerialException, TypeError, OSError): break
+            *lines, buffer = buffer.split(b'\r\n')
+            for line in lines:
+                line = line.decode(errors='replace').strip()
+                if not(len(line)): continue
+                with self._lock:
+                    if not(len(self._pending)):
+                        logger.warning('Unexpected response from TI stimulator: {}', line)
+                        continue
+                    request = self._pending.popleft()
+                if request['TimedOut']: logger.warning('Late response to "{}": {}', request['Command'], line)
+                request['Response'] = line
+                request['Done'].set()
\ No newline at end of file
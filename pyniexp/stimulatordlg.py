@@ -1,29 +1,37 @@
 import os, sys
 from multiprocessing import Process
-from time import time, sleep
+from threading import Thread
+from time import sleep
 
 import pyniexp
 from pyniexp.stimulation import Waveform, Stimulator
+from pyniexp.stimulatorservice import StimulatorClient
 from pyniexp.utils import Status
 
 from numpy import arange, zeros
 
 from PyQt5.uic import loadUi
 from PyQt5.QtWidgets import QApplication, QWidget, QFileDialog
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 import pyqtgraph as pg
 
 class StimulatorApp(QWidget):
     _stimulator = None
-    _t0 = None
-    _timer = None
     _plot = [None, None]
     _waves = [None, None]
-
-    def __init__(self):
+    # from the driver thread of the stimulator to the GUI thread
+    stimulationDone = pyqtSignal()
+    stimulationProgress = pyqtSignal(int)
+    # from the preview thread
+    previewReady = pyqtSignal(int, object)
+    _previewVersion = 0
+    PREVIEW_DELAY = 150 # ms, after the last change
+
+    def __init__(self,service=None):
         super().__init__(parent=None, flags=Qt.Window)
         loadUi(os.path.join(list(pyniexp.__path__)[0],'stimulatordlg.ui'), self)    
 
+        self.service = service # (IP, port) of a StimulatorService to use instead of owning the device
         configFile = None
         if os.path.exists('config_stimulation.json'):
             configFile = 'config_stimulation.json'
@@ -64,8 +72,15 @@ class StimulatorApp(QWidget):
         self.btnRun.clicked.connect(self.run)
         self.btnStop.clicked.connect(self.stop)
         
-        self._timer = QTimer(self)
-        self._timer.timeout.connect(self.updateOnTimer)
+        self.stimulationDone.connect(self.finished)
+        self.stimulationProgress.connect(self.progressBar.setValue)
+
+        # Previews are min/max-decimated to the plot width, computed in a thread after the changes settle
+        self._previewTimer = QTimer(self)
+        self._previewTimer.setSingleShot(True)
+        self._previewTimer.setInterval(self.PREVIEW_DELAY)
+        self._previewTimer.timeout.connect(self.startPreview)
+        self.previewReady.connect(self.showPreview)
 
         self.updateDlg()
         self.updatePlots()
@@ -78,13 +93,19 @@ class StimulatorApp(QWidget):
         self._stimulator = None
 
     def loadConfig(self,configFile=None):
-        if configFile is None:
-            configFile = QFileDialog.getOpenFileName(
-                    caption="Select 'Configuration JSON file'", filter='ini files (*.json)')[0]
-        if len(configFile) == 0:
-                return
-        self._stimulator = None
-        self._stimulator = Stimulator(configFile)
+        if not(self.service is None):
+            self._stimulator = None
+            self._stimulator = StimulatorClient(*self.service) # the service has its own configuration
+        else:
+            if configFile is None:
+                configFile = QFileDialog.getOpenFileName(
+                        caption="Select 'Configuration JSON file'", filter='ini files (*.json)')[0]
+            if len(configFile) == 0:
+                    return
+            self._stimulator = None
+            self._stimulator = Stimulator(configFile)
+        self._stimulator.onDone = self.stimulationDone.emit
+        self._stimulator.onProgress = lambda n: self.stimulationProgress.emit(int(n/self._stimulator.waves[0].samplingRate*1000))
         self.lblStatus.setText(self._stimulator.status.name)
         if self._stimulator.status.value > 0: self.btnLoadWaves.setEnabled(True)
 
@@ -96,8 +117,7 @@ class StimulatorApp(QWidget):
 
     def run(self):
         self._stimulator.stimulate()
-        self._t0 = time()
-        self._timer.start(10)
+        self.lblStatus.setText(self._stimulator.status.name)
         self.btnRun.setEnabled(False)
         self.btnStop.setEnabled(True)
 
@@ -105,7 +125,6 @@ class StimulatorApp(QWidget):
         self._stimulator.stop()
         self.btnRun.setEnabled(False)
         self.btnStop.setEnabled(False)
-        self._timer.stop()
         self.progressBar.setValue(0)
         self.lblStatus.setText(self._stimulator.status.name)
 
@@ -125,21 +144,26 @@ class StimulatorApp(QWidget):
             duration = self.sbDuration.value(), rampUp = self.sbRampUp.value(), rampDown = self.sbRampDown.value(), 
             samplingRate = self.sbSamplingRate.value())
 
-        for i in [0,1]:
-            self._plot[i].getPlotItem().dataItems[0].setData(arange(0,self._waves[i].duration,1/self._waves[i].samplingRate),
-                self._waves[i].signal)
-            self._plot[i].getPlotItem().setXRange(0, self._waves[i].duration, padding=0.0)
-            self._plot[i].getPlotItem().setYRange(-self._waves[i].amplitude*2, self._waves[i].amplitude*2, padding=0.0)
-
         self.progressBar.setMaximum(self._waves[0].duration*1000)
+        self._previewTimer.start() # (re)start
         
-    def updateOnTimer(self):
-        TOL = 10
-        self.progressBar.setValue(int((time()-self._t0)*1000))
-        if self._stimulator.status == Status.STOPPED:
-            self.btnStop.setEnabled(False)
-            self._timer.stop()
-            self.progressBar.setValue(0)
+    def startPreview(self):
+        self._previewVersion += 1
+        widths = [max(self._plot[i].width(),100) for i in [0,1]]
+        Thread(target=lambda v=self._previewVersion, waves=list(self._waves): 
+            self.previewReady.emit(v, [(waves[i], waves[i].preview(widths[i])) for i in [0,1]]),daemon=True).start()
+
+    def showPreview(self,version,previews):
+        if version != self._previewVersion: return # outdated
+        for i in [0,1]:
+            wave, preview = previews[i]
+            self._plot[i].getPlotItem().dataItems[0].setData(*preview)
+            self._plot[i].getPlotItem().setXRange(0, wave.duration, padding=0.0)
+            self._plot[i].getPlotItem().setYRange(-wave.amplitude*2, wave.amplitude*2, padding=0.0)
+
+    def finished(self):
+        self.btnStop.setEnabled(False)
+        self.progressBar.setValue(0)
         self.lblStatus.setText(self._stimulator.status.name)
 
     def setChannel(self,isVisible=[0,0]):
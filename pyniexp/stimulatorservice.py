@@ -0,0 +1,246 @@
+import json, sys
+from threading import Thread, Lock, Event
+import numpy as np
+
+from pyniexp.connection import Tcp
+from pyniexp.stimulation import Stimulator, SampledWave, Wave
+from pyniexp.log import logger
+from pyniexp.utils import Status
+
+# Headless owner of the Stimulator (i.e. the DAQ task), controlled by any number of local clients over TCP.
+# Messages are arrays (connection.send_array): commands and replies are JSON as uint8, waveforms are (channels x samples).
+# Commands do not wait for the output, except 'wait', which blocks only the client sending it.
+# Streamed waves are sent in blocks on a connection of their own, as fast as the service outputs them (constant memory).
+CONTROL_SIGNAL = '#END'
+
+def _send(conn,message,data=None):
+    conn.send_array(np.frombuffer(json.dumps(message).encode(),dtype='uint8'))
+    if not(data is None): conn.send_array(data)
+
+def _receive(conn):
+    d = conn.receive_array()
+    if d is None: return
+    return json.loads(d.tobytes())
+
+class _StreamedWave(Wave):
+    # Samples received from a client block by block, when the Stimulator streams them: in order only, zero after the end
+
+    @property
+    def nSamples(self):
+        return self._nSamples
+
+    @property
+    def duration(self):
+        return self._nSamples/self.samplingRate
+
+    @property
+    def nChannels(self):
+        return self._nChannels
+
+    def __init__(self,conn,nSamples,nChannels,samplingRate):
+        self._conn = conn
+        self._nSamples = nSamples
+        self._nChannels = nChannels
+        self.samplingRate = samplingRate
+        self._buffer = np.zeros((nChannels,0)) # received, not yet output
+        self._received = 0
+        self._next = 0
+
+    def chunk(self,start,n):
+        if start != self._next: raise ValueError('Streamed samples cannot be output again')
+        while self._buffer.shape[1] < n and self._received < self._nSamples:
+            block = self._conn.receive_array()
+            if block is None: raise ConnectionError('Stream is closed after {:d} samples'.format(self._received))
+            self._received += block.shape[1]
+            self._buffer = np.hstack((self._buffer,block))
+        data = np.zeros((self._nChannels,n))
+        k = min(n,self._buffer.shape[1])
+        data[:,:k] = self._buffer[:,:k]
+        self._buffer = self._buffer[:,k:]
+        self._next += n
+        if self._received >= self._nSamples: self.close()
+        return data if self._nChannels > 1 else data[0]
+
+    def close(self):
+        if self._conn.is_open: self._conn.close(send_control_signal=False)
+
+class StimulatorService:
+
+    def __init__(self,configFile='config_stimulation.json',port=5200,host='127.0.0.1'):
+        self.port = port
+        self.host = host # '' to accept clients from other hosts
+        self._stimulator = Stimulator(configFile)
+        self._lock = Lock() # one command at a time
+        self._clients = []
+        self._stream = None # _StreamedWave being output
+
+    def run(self):
+        listener = Tcp.listen(self.port,host=self.host)
+        logger.info('Stimulator service is listening on {}:{:d}', self.host or '*', self.port)
+        try:
+            while True:
+                conn = Tcp(port=self.port,control_signal=CONTROL_SIGNAL)
+                conn.open_as_server(listener)
+                conn.timeout = None # clients may be idle
+                Thread(target=self._serve,args=(conn,),daemon=True).start()
+        finally:
+            listener.close()
+            self._stimulator = None
+
+    def _serve(self,conn):
+        self._clients.append(conn)
+        while conn.is_open:
+            cmd = _receive(conn)
+            if cmd is None: break
+            try: reply = self._handle(conn,cmd)
+            except Exception as e:
+                logger.exception('Command {} failed', cmd['Command'])
+                reply = {'Error': str(e)}
+            reply.update(self._status())
+            _send(conn,reply)
+            if cmd['Command'] == 'stream':
+                if 'Error' in reply: break
+                self._clients.remove(conn)
+                return # the connection carries the samples
+        conn.close(send_control_signal=False)
+        self._clients.remove(conn)
+
+    def _handle(self,conn,cmd):
+        if cmd['Command'] == 'load':
+            data = conn.receive_array() if 'SamplingRate' in cmd else None # no waves: reloaded
+            with self._lock:
+                self._stimulator.loadWaveform(None if data is None else SampledWave(data,cmd['SamplingRate']))
+                self._setStream(None)
+        elif cmd['Command'] == 'stream': # on its own connection
+            wave = _StreamedWave(conn,cmd['NSamples'],cmd['Channels'],cmd['SamplingRate'])
+            with self._lock:
+                self._stimulator.streamWaveform(wave,leadTime=cmd.get('LeadTime',1),chunkDuration=cmd.get('ChunkDuration',0.1))
+                self._setStream(wave)
+        elif cmd['Command'] == 'start':
+            with self._lock: self._stimulator.stimulate()
+        elif cmd['Command'] == 'stop':
+            with self._lock:
+                self._stimulator.stop()
+                self._setStream(None)
+        elif cmd['Command'] == 'wait':
+            return {'Done': self._stimulator.waitUntilDone(cmd.get('Timeout',None))}
+        elif cmd['Command'] != 'status':
+            return {'Error': 'Unknown command {}'.format(cmd['Command'])}
+        return {}
+
+    def _setStream(self,wave):
+        # (with the lock) after the Stimulator has stopped the previous one
+        if not(self._stream is None): self._stream.close()
+        self._stream = wave
+
+    def _status(self):
+        return {'Status': self._stimulator.status.name, 'SamplesOutput': self._stimulator.samplesOutput, 'Clients': len(self._clients)}
+
+class StimulatorClient:
+    # Thin client of StimulatorService with the interface of Stimulator used by experiment scripts and StimulatorApp
+    # Calls return as soon as the service has processed the command; onDone is called from a thread waiting on a second connection
+    onDone = None
+    onProgress = None # not supported, samplesOutput is reported by status
+    reply = {}
+
+    @property
+    def status(self):
+        return Status[self._request({'Command': 'status'})['Status']]
+
+    @property
+    def samplesOutput(self):
+        return self._request({'Command': 'status'})['SamplesOutput']
+
+    def __init__(self,IP='127.0.0.1',port=5200):
+        self._conn = Tcp(IP,port,control_signal=CONTROL_SIGNAL)
+        self._conn.open_as_client()
+        self._IP = IP; self._port = port
+        self._lock = Lock()
+        self.waves = []
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._conn.is_open: self._conn.close()
+
+    def loadWaveform(self,waveList=None,waitUntilFinished=False):
+        # Waves are sampled here and sent as one (channels x samples) array; None reloads the waves on the service
+        if isinstance(waveList,Wave): waveList = [waveList]
+        if waitUntilFinished and self.status == Status.RUNNING: self.waitUntilDone()
+        if waveList is None:
+            self._request({'Command': 'load'})
+            return
+        data = np.ascontiguousarray(np.vstack([w.signal for w in waveList]),dtype='float64')
+        self.waves = waveList
+        self._request({'Command': 'load', 'SamplingRate': waveList[0].samplingRate},data)
+
+    def streamWaveform(self,waveList=None,waitUntilFinished=False,leadTime=1,chunkDuration=0.1):
+        # Waves are sampled here chunk by chunk (None: the last waves, from the start) and sent on a connection of their own,
+        # which blocks when the service is leadTime ahead of the output
+        if isinstance(waveList,Wave): waveList = [waveList]
+        if waveList is None: waveList = self.waves
+        assert len(waveList), "No waves to stream"
+        if waitUntilFinished and self.status == Status.RUNNING: self.waitUntilDone()
+        self.waves = waveList
+        samplingRate = waveList[0].samplingRate
+        nChunk = max(int(round(chunkDuration*samplingRate)),1)
+        nSamples = waveList[0].nSamples
+        nChannels = sum([w.nChannels for w in waveList])
+
+        conn = Tcp(self._IP,self._port,control_signal=CONTROL_SIGNAL)
+        conn.quiet = True
+        conn.open_as_client()
+        conn.timeout = None
+        replied = Event()
+        _send(conn,{'Command': 'stream', 'SamplingRate': samplingRate, 'NSamples': nSamples, 'Channels': nChannels,
+            'LeadTime': leadTime, 'ChunkDuration': chunkDuration})
+        Thread(target=self._sendStream,args=(conn,waveList,nSamples,nChunk,replied),daemon=True).start()
+        self.reply = _receive(conn) # after the service has prefilled its buffer
+        replied.set()
+        if self.reply is None: raise ConnectionError('No reply from the stimulator service')
+        if 'Error' in self.reply: logger.error('Stimulator service: {}', self.reply['Error'])
+
+    def stimulate(self):
+        self._request({'Command': 'start'})
+        if not(self.onDone is None): Thread(target=self._waitForDone,daemon=True).start()
+
+    def stop(self):
+        self._request({'Command': 'stop'})
+
+    def waitUntilDone(self,timeout=None):
+        conn = Tcp(self._IP,self._port,control_signal=CONTROL_SIGNAL) # not to block the other calls
+        conn.quiet = True
+        conn.open_as_client()
+        conn.timeout = None
+        _send(conn,{'Command': 'wait', 'Timeout': timeout})
+        reply = _receive(conn)
+        conn.close()
+        if reply is None:
+            logger.error('Stimulator service closed the connection while waiting')
+            return False
+        return reply.get('Done',False)
+
+    def _waitForDone(self):
+        if self.waitUntilDone(): self.onDone()
+
+    def _sendStream(self,conn,waveList,nSamples,nChunk,replied):
+        try:
+            for start in range(0,nSamples,nChunk):
+                n = min(nChunk,nSamples-start)
+                if conn.send_array(np.vstack([w.chunk(start,n) for w in waveList]).astype('float64')) is None: break
+        except OSError: pass # closed by the service (e.g. stopped)
+        replied.wait()
+        conn.close(send_control_signal=False)
+
+    def _request(self,cmd,data=None):
+        with self._lock:
+            _send(self._conn,cmd,data)
+            self.reply = _receive(self._conn)
+        if self.reply is None: raise ConnectionError('No reply from the stimulator service')
+        if 'Error' in self.reply: logger.error('Stimulator service: {}', self.reply['Error'])
+        return self.reply
+
+if __name__ == '__main__':
+    # python -m pyniexp.stimulatorservice [config_stimulation.json [port [host]]]
+    StimulatorService(*sys.argv[1:2],*[int(p) for p in sys.argv[2:3]],*sys.argv[3:4]).run()
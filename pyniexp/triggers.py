@@ -1,6 +1,6 @@
 import serial
 from pyniexp.utils import listSerial
-from loguru import logger
+from pyniexp.log import logger
 
 class BrainVision:
     _port = []
@@ -1,5 +1,7 @@
 from time import time
-from multiprocessing import Value
+from math import log10, sqrt, inf
+from bisect import bisect
+from multiprocessing import Value, RawArray
 from enum import Enum
 from serial.tools import list_ports
 
@@ -35,3 +37,57 @@ class clock:
 
     def reset_clock(self):
         self._t0.value = time()
+
+
+class Histogram:
+    # Fixed log-spaced bins: constant-time update, percentiles with bin resolution (~25% for 10 bins per decade)
+    # shared=True stores the counts in shared memory for a single writer process and any number of readers
+
+    def __init__(self,low=1e-6,high=10,bins_per_decade=10,shared=False):
+        n = round(log10(high/low)*bins_per_decade)
+        self.edges = [low*10**(i/bins_per_decade) for i in range(n+1)]
+        if shared:
+            self._counts = RawArray('Q', n+2) # + underflow and overflow
+            self._moments = RawArray('d', [0, inf, -inf]) # sum, min, max
+        else:
+            self._counts = [0]*(n+2)
+            self._moments = [0, inf, -inf]
+
+    def add(self,val):
+        self._counts[bisect(self.edges,val)] += 1
+        self._moments[0] += val
+        if val < self._moments[1]: self._moments[1] = val
+        if val > self._moments[2]: self._moments[2] = val
+
+    def reset(self):
+        for i in range(len(self._counts)): self._counts[i] = 0
+        self._moments[:] = [0, inf, -inf]
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def mean(self):
+        n = self.count
+        if n: return self._moments[0]/n
+
+    def percentile(self,p):
+        counts = self._counts[:]
+        n = sum(counts)
+        if not(n): return
+
+        c = 0
+        for i in range(len(counts)):
+            c += counts[i]
+            if c >= p/100*n: break
+        if i == 0: return self._moments[1] # underflow
+        if i == len(counts)-1: return self._moments[2] # overflow
+        return min(max(sqrt(self.edges[i-1]*self.edges[i]),self._moments[1]),self._moments[2]) # geometric bin centre
+
+    def summary(self):
+        return {
+            'count': self.count, 'mean': self.mean,
+            'min': self._moments[1] if self.count else None, 'max': self._moments[2] if self.count else None,
+            'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99)
+        }
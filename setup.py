@@ -7,7 +7,7 @@ setup(
     author_email='tibor.auer@gmail.com',
     
     packages=['pyniexp'],
-    install_requires=['keyboard','nidaqmx','loguru','matplotlib','pyserial','pyqt5','pyqtgraph'],
+    install_requires=['keyboard','numpy','nidaqmx','matplotlib','pyserial','pyqt5','pyqtgraph'],
     
     package_data={'pyniexp': ['stimulatordlg.ui']},
     include_package_data=True,
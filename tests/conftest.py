@@ -0,0 +1,4 @@
+import sys, os
+
+# The tests run against the simulated DAQ in tests/fake, not a device
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'fake'))
@@ -0,0 +1,130 @@
+# Simulated nidaqmx for the tests: finite analog output, started directly or by a start trigger fired with fire()
+import time, types
+from datetime import datetime
+from enum import Enum
+from threading import Timer
+
+class DaqError(Exception):
+    pass
+
+class constants:
+
+    class AcquisitionType(Enum):
+        FINITE = 1
+        CONTINUOUS = 2
+
+    class Edge(Enum):
+        RISING = 1
+        FALLING = 2
+
+_armed = [] # tasks waiting for their start trigger
+
+def fire(source, edge=constants.Edge.RISING):
+    # a pulse on the terminal: starts the tasks armed for it and returns the time of the edge
+    t = time.time()
+    for task in list(_armed):
+        trigger = task.triggers.start_trigger
+        if trigger.source == source and trigger.edge == edge:
+            _armed.remove(task)
+            trigger.ts = datetime.fromtimestamp(t)
+            task._output()
+    return t
+
+class _StartTrigger:
+
+    def __init__(self):
+        self.source = None
+        self.edge = None
+        self.retriggerable = False
+        self.timestamp_enable = False
+        self.ts = None
+
+    def cfg_dig_edge_start_trig(self,trigger_source,trigger_edge=constants.Edge.RISING):
+        self.source = trigger_source
+        self.edge = trigger_edge
+
+    def disable_start_trig(self):
+        self.source = None
+        self.edge = None
+
+    @property
+    def timestamp_val(self):
+        if not(self.timestamp_enable) or self.ts is None: raise DaqError('No trigger time stamp')
+        return self.ts
+
+class _Timing:
+
+    def __init__(self):
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = 0
+        self.samp_clk_rate = 1
+
+    def cfg_samp_clk_timing(self,rate,sample_mode,samps_per_chan):
+        self.samp_clk_rate = rate
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = samps_per_chan
+
+    def cfg_implicit_timing(self,sample_mode):
+        self.samp_quant_samp_mode = sample_mode
+
+class _Device:
+    name = 'Dev2'
+
+    def self_test_device(self):
+        pass
+
+class system:
+
+    class System:
+
+        @staticmethod
+        def local():
+            return types.SimpleNamespace(devices=[_Device()])
+
+class Task:
+    created = 0
+
+    def __init__(self):
+        Task.created += 1
+        self.ao_channels = types.SimpleNamespace(add_ao_voltage_chan=lambda name: None)
+        self.co_channels = types.SimpleNamespace(add_co_pulse_chan_ticks=lambda *args, **kwargs: None)
+        self.triggers = types.SimpleNamespace(start_trigger=_StartTrigger())
+        self.timing = _Timing()
+        self.out_stream = types.SimpleNamespace(task=self)
+        self.data = None
+        self.closed = False
+        self._done = None
+        self._timer = None
+
+    def register_done_event(self,callback):
+        self._done = callback
+
+    def register_every_n_samples_transferred_from_buffer_event(self,n,callback):
+        pass
+
+    def write(self,data):
+        pass
+
+    def start(self):
+        if self.triggers.start_trigger.source is None: self._output()
+        else: _armed.append(self)
+
+    def stop(self):
+        if self in _armed: _armed.remove(self)
+        if not(self._timer is None): self._timer.cancel()
+        self._timer = None
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def is_task_done(self):
+        return not(self in _armed) and (self._timer is None or not(self._timer.is_alive()))
+
+    def _output(self):
+        # finite output: done after the samples at the sampling rate
+        self._timer = Timer(self.timing.samp_quant_samp_per_chan/self.timing.samp_clk_rate, self._finish)
+        self._timer.start()
+
+    def _finish(self):
+        if not(self._done is None): self._done(None,0,None)
@@ -0,0 +1,7 @@
+class AnalogMultiChannelWriter:
+
+    def __init__(self,task_out_stream,auto_start=False):
+        self._task = task_out_stream.task
+
+    def write_many_sample(self,data,timeout=10.0):
+        self._task.data = data.copy()
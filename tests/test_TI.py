@@ -0,0 +1,72 @@
+import sys, os, json, time
+import pytest
+from pyniexp.stimulation import TI
+from pyniexp.utils import Status
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='the simulator runs on a pseudo-terminal')
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+sys.path.insert(0, EXAMPLES)
+from TI_simulator import TISimulator
+
+class FailingSimulator(TISimulator):
+    # answers the first DDS with an error, immediately
+    def respond(self,cmd):
+        if cmd.startswith('DDS 0'): return 'ERR bad'
+        return super().respond(cmd)
+
+def stimulator(tmp_path,simulator,**config):
+    with open(os.path.join(EXAMPLES, 'config_TI_sim.json')) as f: c = json.load(f)
+    c.update({'Port': simulator.start(), 'rampUp': 10, 'rampDown': 10}, **config)
+    configFile = tmp_path / 'config_TI_sim.json'
+    configFile.write_text(json.dumps(c))
+    ti = TI(str(configFile))
+    ti.verbose = False
+    ti.connect()
+    return ti
+
+def test_pipelined(tmp_path):
+    sim = TISimulator(latency=0.05)
+    ti = stimulator(tmp_path,sim)
+    t = time.perf_counter()
+    requests = [ti.sendCommand('DDS {:d} 2000'.format(ch),nowait=True) for ch in [0, 1]]
+    assert time.perf_counter() - t < 0.05 # not waiting
+    assert ti.waitForDevice(requests)
+    assert [r['Response'] for r in requests] == ['OK', 'OK']
+
+    ti.load()
+    assert ti.status == Status.CONFIGURED
+    assert [c.split()[0] for c in sim.log[2:]] == ['DDS', 'DDS', 'ChConfig']
+
+def test_fast_error(tmp_path):
+    sim = FailingSimulator(latency=0.01)
+    ti = stimulator(tmp_path,sim)
+    request = ti.sendCommand('DDS 0 2000',nowait=True)
+    time.sleep(0.05) # answered, no longer pending
+    assert not(ti.waitForDevice(request))
+
+    ti.load()
+    assert ti.status != Status.CONFIGURED
+
+def test_timeout(tmp_path):
+    sim = TISimulator(latency=0.3)
+    ti = stimulator(tmp_path,sim,Timeout=0.1)
+    assert not(ti.sendCommand('DDS 0 2000'))
+    time.sleep(0.3) # the late response does not match the next command
+    assert ti.sendCommand('DDS 1 2000',timeout=0.5)
+
+def test_min_interval(tmp_path):
+    sim = TISimulator(latency=0.001)
+    ti = stimulator(tmp_path,sim,MinInterval=0.1,rampUpdate=10)
+    ti.load()
+    ti.start()
+    assert ti.status == Status.RUNNING
+    for i in range(10):
+        ti.setAmplitude([1+i/10, 1+i/10])
+        time.sleep(0.03)
+    ti.stopWriter()
+    sent = [c['Time'] for c in ti.commandLog]
+    assert all(c['Acknowledged'] for c in ti.commandLog)
+    assert all(t2 - t1 >= 0.1 - 1e-3 for t1, t2 in zip(sent,sent[1:]))
+    assert ti.coalesced > 0
+    assert ti._output == [1.9, 1.9] # the newest target is sent last
@@ -0,0 +1,55 @@
+import json, time
+import nidaqmx
+from pyniexp.stimulation import Stimulator, Tone
+from pyniexp.utils import Status
+
+def stimulator(tmp_path,hardware='Dev2'):
+    config = tmp_path / 'config_stimulation.json'
+    config.write_text(json.dumps({'DAQ': {'Hardware': hardware}, 'ControlSignal': 0, 'Channels': ['ao0','ao1'], 'Trigger': {'Source': 'PFI0'}}))
+    return Stimulator(str(config))
+
+def wave():
+    return Tone(amplitude=[1,1],frequency=10,duration=0.2,samplingRate=1000)
+
+def test_configured_on_the_task(tmp_path):
+    stim = stimulator(tmp_path)
+    stim.armTrigger(source='PFI3',edge='FALLING',retriggerable=True)
+    trigger = stim._DAQ.triggers.start_trigger
+    assert trigger.source == '/Dev2/PFI3' and trigger.edge == nidaqmx.constants.Edge.FALLING
+    assert trigger.retriggerable and trigger.timestamp_enable
+
+    stim.loadWaveform(wave()) # new task, same trigger
+    trigger = stim._DAQ.triggers.start_trigger
+    assert trigger.source == '/Dev2/PFI3' and trigger.edge == nidaqmx.constants.Edge.FALLING
+
+def test_onset_from_the_trigger(tmp_path):
+    stim = stimulator(tmp_path)
+    stim.armTrigger()
+    stim.loadWaveform(wave())
+    stim.stimulate()
+    assert stim.status == Status.RUNNING and stim.triggerTime is None # armed, waiting for the pulse
+    time.sleep(0.1)
+    nidaqmx.fire('/Dev2/PFI0',nidaqmx.constants.Edge.FALLING) # wrong edge
+    assert not(stim.waitUntilDone(0.3))
+
+    pulse = nidaqmx.fire('/Dev2/PFI0')
+    assert abs(stim.triggerTime - pulse) < 1e-6 # the pulse, not stimulate()
+    assert not(stim.waitUntilDone(0.1)) and stim.waitUntilDone(1) # the waves after the pulse
+
+def test_rearm_and_disarm(tmp_path):
+    stim = stimulator(tmp_path)
+    created = nidaqmx.Task.created
+    stim.armTrigger(everyN=4, retriggerable=True)
+    divider = stim._divider
+    stim.armTrigger(everyN=2, retriggerable=True)
+    assert nidaqmx.Task.created == created + 2 and divider.closed and not(stim._divider.closed)
+    assert stim._DAQ.triggers.start_trigger.source == '/Dev2/Ctr0InternalOutput'
+
+    stim.disarmTrigger()
+    assert stim._divider is None
+    assert stim._DAQ.triggers.start_trigger.source is None and not(stim._DAQ.triggers.start_trigger.retriggerable)
+
+def test_without_DAQ(tmp_path):
+    stim = stimulator(tmp_path,'Dev9')
+    stim.armTrigger() # logged
+    assert stim._trigger is None